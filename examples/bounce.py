@@ -1,8 +1,8 @@
 """ Test TimeBox interface"""
 import random
-from time import sleep
 from timebox import TimeBox
 from timeboximage import TimeBoxImage
+from pacing import run_at_fps
 
 
 
@@ -72,12 +72,15 @@ TIMEBOX.connect()
 BALLS = [Ball(0xf, 0x0, 0x0), Ball(0x0, 0xf, 0x0), Ball(0x0, 0x0, 0xf), \
          Ball(0xf, 0xf, 0x0), Ball(0x0, 0xf, 0xf), Ball(0xf, 0x0, 0xf)]
 
-while True:
-    IMAGE = TimeBoxImage()
-    for ball in BALLS:
-        ball.image_add(IMAGE)
-        ball.update(DELAY)
-    TIMEBOX.set_static_image(IMAGE)
-    sleep(DELAY)
+def frames():
+    """Generate the images of the bouncing balls."""
+    while True:
+        image = TimeBoxImage()
+        for ball in BALLS:
+            ball.image_add(image)
+            ball.update(DELAY)
+        yield image
+
+run_at_fps(frames(), 1.0 / DELAY, TIMEBOX.set_static_image)
 
 TIMEBOX.close()
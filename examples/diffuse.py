@@ -1,13 +1,10 @@
 """A visual animation of colors diffusing."""
 from math import exp
-from time import sleep
 from random import randrange, random
 from operator import add
 from timebox import TimeBox
 from timeboximage import TimeBoxImage
-
-TIMEBOX = TimeBox()
-TIMEBOX.connect()
+from pacing import FramePacer
 
 class Diffuse:
     """Class implementing the animation of colors diffusing."""
@@ -92,14 +89,19 @@ class Diffuse:
 
 
 
-DIFFUSE = Diffuse()
+if __name__ == '__main__':
+    TIMEBOX = TimeBox()
+    TIMEBOX.connect(reader=True)
+
+    DIFFUSE = Diffuse()
+    PACER = FramePacer(20)
 
-while True:
-    TIMEBOX.set_static_image(DIFFUSE.as_image())
-    sleep(0.05)
-    DIFFUSE.apply_kernel()
-    if random() < 0.20:
-        DIFFUSE.add_random_dot()
-    TIMEBOX.clear_input_buffer_quick()
+    while True:
+        PACER.wait()
+        TIMEBOX.set_static_image(DIFFUSE.as_image())
+        DIFFUSE.apply_kernel()
+        if random() < 0.20:
+            DIFFUSE.add_random_dot()
+        TIMEBOX.clear_input_buffer_quick()
 
-TIMEBOX.close()
+    TIMEBOX.close()
@@ -2,24 +2,29 @@
 from time import sleep
 from timebox import TimeBox
 from life import GameOfLife
+from pacing import FramePacer
 
 TIMEBOX = TimeBox()
-TIMEBOX.connect()
+TIMEBOX.connect(reader=True)
+# still lifes repeat the same image, do not send those again
+TIMEBOX.set_skip_unchanged()
 
 GOL = GameOfLife()
 GOL.randomize_board()
+PACER = FramePacer(25)
 
 while True:
     GOL.randomize_board()
     for i in range(100):
         for j in range(GOL.animationSteps):
+            PACER.wait()
             TIMEBOX.set_static_image(GOL.as_image(j))
-            sleep(0.04)
         old_board = GOL.board
         GOL.iterate()
         TIMEBOX.clear_input_buffer_quick()
         if old_board == GOL.board:
             sleep(4.0)
+            PACER.reset()
             break
 
 TIMEBOX.close()
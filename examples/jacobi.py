@@ -136,20 +136,21 @@ class JacobiIteration:
         return self.theta()
 
 
-JACOBI = JacobiIteration()
-
-# create the Timebox object
-TIMEBOX = TimeBox()
-# open the connection to the Timebox
-TIMEBOX.connect()
-
-while True:
-    JACOBI.randomize_matrix()
-
-    THETA = 1
-    while abs(THETA) > 0.05:
-        THETA = JACOBI.iterate()
-        IMAGE = JACOBI.as_image()
-        TIMEBOX.set_static_image(IMAGE)
-        sleep(0.5)
-        TIMEBOX.clear_input_buffer()
+if __name__ == '__main__':
+    JACOBI = JacobiIteration()
+
+    # create the Timebox object
+    TIMEBOX = TimeBox()
+    # open the connection to the Timebox
+    TIMEBOX.connect(reader=True)
+
+    while True:
+        JACOBI.randomize_matrix()
+
+        THETA = 1
+        while abs(THETA) > 0.05:
+            THETA = JACOBI.iterate()
+            IMAGE = JACOBI.as_image()
+            TIMEBOX.set_static_image(IMAGE)
+            sleep(0.5)
+            TIMEBOX.clear_input_buffer()
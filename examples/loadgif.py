@@ -1,9 +1,8 @@
-"""Load a gif file and display it on TimeBox."""
+"""Load a gif file, scale it to the size of the display and show it on TimeBox."""
 
 import sys
-from timeboximage import TimeBoxImage
 from timebox import TimeBox
-from gifreader import GIFReader
+from utils.gifreader import GIFReader
 
 if len(sys.argv) < 2:
     print('Please provide name of a GIF file to display.')
@@ -12,14 +11,7 @@ if len(sys.argv) < 2:
 FILENAME = sys.argv[1]
 
 GIFREADER = GIFReader()
-GIFREADER.read(FILENAME)
-
-IMAGE = TimeBoxImage()
-for xix in range(11):
-    for yix in range(11):
-        IMAGE.put_pixel(xix, yix, GIFREADER.output_image[xix][yix][0] >> 4, \
-                            GIFREADER.output_image[xix][yix][1] >>4, \
-                            GIFREADER.output_image[xix][yix][2]>>4)
+IMAGE = GIFREADER.read_scaled(FILENAME, 11, 11)
 
 TIMEBOX = TimeBox()
 TIMEBOX.connect()
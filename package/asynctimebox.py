@@ -0,0 +1,178 @@
+"""Provides class AsyncTimeBox, an asyncio based client for the TimeBox."""
+
+import asyncio
+import socket
+from messages import TimeBoxMessages
+from messageparser import MessageParser
+
+class AsyncTimeBox:
+    """Class AsyncTimeBox encapsulates the TimeBox communication with coroutines.
+    Outgoing messages pass through a bounded queue: when it is full, the sending coroutines
+    wait, so producers cannot run ahead of the connection. A writer task writes every
+    message completely before taking the next one."""
+
+    DEFAULTHOST = "11:75:58:48:2F:DA"
+
+    COMMANDS = TimeBoxMessages.COMMANDS
+
+    messages = None
+    parser = None
+    reader = None
+    writer = None
+
+    send_queue = None
+    received = None
+    dropped_messages = 0
+    error = None
+
+    def __init__(self, max_queue=16, max_messages=256,
+                 max_buffer_size=MessageParser.DEFAULT_MAX_SIZE):
+        self.messages = TimeBoxMessages()
+        self.parser = MessageParser(max_buffer_size, self.messages)
+        self.max_queue = max_queue
+        self.max_messages = max_messages
+        self._tasks = []
+        self._waiters = {}
+
+    async def connect(self, host=None, port=4, sock=None):
+        """Open a connection to the TimeBox over RFCOMM, or use the connected stream socket
+        sock instead (for instance one end of a socketpair or a TCP connection)."""
+        if sock is None:
+            if host is None:
+                host = self.DEFAULTHOST
+            sock = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
+            sock.setblocking(False)
+            await asyncio.get_running_loop().sock_connect(sock, (host, port))
+        self.reader, self.writer = await asyncio.open_connection(sock=sock)
+        self.send_queue = asyncio.Queue(self.max_queue)
+        self.received = asyncio.Queue(self.max_messages)
+        self.error = None
+        self._tasks = [asyncio.ensure_future(self._write_loop()),
+                       asyncio.ensure_future(self._read_loop())]
+
+    async def close(self):
+        """Send the queued messages and close the connection."""
+        await self.flush()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+    async def _write_loop(self):
+        """Write the queued messages to the connection."""
+        while True:
+            data = await self.send_queue.get()
+            try:
+                if self.error is None:
+                    self.writer.write(data)
+                    await self.writer.drain()
+            except OSError as err:
+                self.error = err
+            finally:
+                self.send_queue.task_done()
+
+    async def _read_loop(self):
+        """Read from the connection and dispatch the received messages."""
+        while True:
+            try:
+                data = await self.reader.read(1024)
+            except OSError as err:
+                data = b''
+                self.error = err
+            if not data:
+                for waiter in self._waiters.values():
+                    if not waiter.done():
+                        waiter.set_exception(ConnectionError('Connection closed'))
+                return
+            self.parser.feed(data)
+            for payload in self.parser.iter_messages():
+                self._dispatch(payload)
+
+    def _dispatch(self, payload):
+        """Hand a received message to the coroutine waiting for a response to its command,
+        or queue it, dropping the oldest queued message if the queue is full."""
+        # responses are of the form LL LL 04 CC 55 ..., CC the command responded to
+        if len(payload) > 3:
+            waiter = self._waiters.get(payload[3])
+            if waiter is not None and not waiter.done():
+                waiter.set_result(payload)
+                return
+        if self.received.full():
+            self.received.get_nowait()
+            self.dropped_messages += 1
+        self.received.put_nowait(payload)
+
+    async def send_raw(self, data):
+        """Queue raw data to be sent to the TimeBox. Waits while the queue is full."""
+        if self.error is not None:
+            raise self.error
+        await self.send_queue.put(bytes(data))
+
+    async def send_payload(self, payload):
+        """Queue raw payload to be sent to the TimeBox. (Will be escaped, checksumed and
+        messaged between 0x01 and 0x02."""
+        await self.send_raw(self.messages.frame_message(payload))
+
+    async def send_command(self, command, args=None):
+        """Queue command with optional arguments"""
+        await self.send_payload(self.messages.command_payload(command, args))
+
+    async def request(self, command, args=None, timeout=1.0):
+        """Send command with optional arguments and wait for the response of the TimeBox to
+        that command. Returns the decoded response payload (bytes). Raises asyncio.TimeoutError
+        if there is no response within timeout seconds."""
+        if isinstance(command, str):
+            command = self.COMMANDS[command]
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[command] = waiter
+        try:
+            await self.send_command(command, args)
+            return await asyncio.wait_for(waiter, timeout)
+        finally:
+            if self._waiters.get(command) is waiter:
+                del self._waiters[command]
+
+    async def flush(self):
+        """Wait until all queued messages have been written. Raises the error of the
+        connection, if writing failed."""
+        await self.send_queue.join()
+        if self.error is not None:
+            raise self.error
+
+    async def get_message(self, timeout=None):
+        """Wait for a message from the TimeBox and return its decoded payload (bytes).
+        Returns None if no message arrived within timeout seconds."""
+        try:
+            return await asyncio.wait_for(self.received.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def set_static_image(self, image):
+        """Set the image on the TimeBox"""
+        await self.send_raw(self.messages.static_image_frame(image))
+
+    async def set_dynamic_images(self, images, frame_delay):
+        """Set the images of an animation on the TimeBox"""
+        fnum = 0
+        for img in images:
+            await self.send_raw(self.messages.dynamic_image_frame(img, fnum, frame_delay))
+            fnum = fnum + 1
+
+    async def show_temperature(self, color=None):
+        """Show temperature on the TimeBox in Celsius"""
+        args = [0x01, 0x00]
+        if not color is None:
+            args += color
+        await self.send_command("set view", args)
+
+    async def show_clock(self, color=None):
+        """Show clock on the TimeBox in the color"""
+        args = [0x00, 0x01]
+        if not color is None:
+            args += color
+        await self.send_command("set view", args)
@@ -0,0 +1,88 @@
+"""Provides class Bundle to write and read files of pre-encoded TimeBox messages.
+See doc/bundle.md for the file format."""
+
+import mmap
+import struct
+
+class Bundle:
+    """A bundle file, read through a memory map. Iterating over it yields the messages as
+    memoryviews on the file, which are only valid until the iteration continues."""
+
+    MAGIC = b'TBXB'
+    VERSION = 1
+    FLAG_STATIC = 0x0001
+    HEADER = struct.Struct('<4sHHIHH16s')
+    INDEX_ENTRY = struct.Struct('<II')
+
+    file = None
+    map = None
+    view = None
+
+    flags = None
+    frame_count = None
+    delay = None
+    source_hash = None
+
+    def __init__(self, fname):
+        """Open the bundle file fname."""
+        self.file = open(fname, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise Exception('Not a bundle file: empty')
+        self.view = memoryview(self.map)
+        if len(self.view) < self.HEADER.size:
+            self.close()
+            raise Exception('Not a bundle file: too short')
+        magic, version, self.flags, self.frame_count, self.delay, _, self.source_hash = \
+            self.HEADER.unpack_from(self.view)
+        if magic != self.MAGIC or version != self.VERSION:
+            self.close()
+            raise Exception('Not a bundle file, or unsupported version')
+
+    @classmethod
+    def write(cls, fname, messages, delay=0, static=False, source_hash=b''):
+        """Write the messages (bytes-like objects with complete messages) to the bundle file
+        fname. delay and static as described in doc/bundle.md."""
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, cls.FLAG_STATIC if static else 0,
+                                 len(messages), delay, 0, bytes(source_hash[:16]))
+        with open(fname, 'wb') as file:
+            file.write(header)
+            offset = cls.HEADER.size + cls.INDEX_ENTRY.size * len(messages)
+            for msg in messages:
+                file.write(cls.INDEX_ENTRY.pack(offset, len(msg)))
+                offset += len(msg)
+            for msg in messages:
+                file.write(msg)
+
+    @property
+    def static(self):
+        """True if the bundle holds static images, False if it holds animation frames."""
+        return (self.flags & self.FLAG_STATIC) != 0
+
+    def __len__(self):
+        return self.frame_count
+
+    def __iter__(self):
+        for fnum in range(self.frame_count):
+            offset, length = self.INDEX_ENTRY.unpack_from(
+                self.view, self.HEADER.size + fnum * self.INDEX_ENTRY.size)
+            with self.view[offset:offset + length] as msg:
+                yield msg
+
+    def close(self):
+        """Close the bundle file."""
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,34 @@
+"""Provides shared gamma correction tables, computed once per gamma value and scale."""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_TABLES = {}
+_ARRAYS = {}
+
+def gamma_table(gamma, scale=256.0):
+    """Return the table mapping brightness k (0-255) to the pixel value (0-15)
+    int(scale*pow(k/256, 1/gamma)) >> 4, as bytes. gamma None gives k >> 4. The table can
+    be indexed and used with bytes.translate."""
+    key = (gamma, scale)
+    table = _TABLES.get(key)
+    if table is None:
+        if gamma is None:
+            table = bytes(k >> 4 for k in range(256))
+        else:
+            table = bytes(int(scale*pow((k/256.0), 1.0 / gamma)) >> 4 for k in range(256))
+        _TABLES[key] = table
+    return table
+
+def gamma_array(gamma, scale=256.0):
+    """Return the table of gamma_table as uint8 numpy array, for use with numpy.take."""
+    if np is None:
+        raise ImportError('gamma_array requires numpy')
+    key = (gamma, scale)
+    array = _ARRAYS.get(key)
+    if array is None:
+        array = np.frombuffer(gamma_table(gamma, scale), dtype=np.uint8)
+        _ARRAYS[key] = array
+    return array
@@ -0,0 +1,105 @@
+"""Provides class MessageParser to split the data received from the TimeBox into messages."""
+
+from messages import TimeBoxMessages
+
+class MessageParser:
+    """Incrementally collects the data received from the TimeBox and splits it into
+    messages and garbage (data outside of a message). The received data is kept in a
+    bytearray of bounded size, and the position up to which it has been searched for
+    the end of a message is remembered, so data is only scanned once."""
+
+    DEFAULT_MAX_SIZE = 4096
+
+    buffer = None
+    max_size = None
+    messages = None
+
+    # position up to which the buffer contains no end marker 0x02
+    scan_pos = 0
+
+    garbage_bytes = 0
+    overflow_bytes = 0
+    bad_messages = 0
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, messages=None):
+        self.buffer = bytearray()
+        self.max_size = max_size
+        self.messages = TimeBoxMessages() if messages is None else messages
+
+    def feed(self, data):
+        """Add received data to the buffer. If the buffer grows beyond its maximum size,
+        the oldest data is dropped."""
+        self.buffer += data
+        excess = len(self.buffer) - self.max_size
+        if excess > 0:
+            self.overflow_bytes += excess
+            self._discard(excess)
+
+    def _discard(self, num_bytes):
+        """Remove num_bytes from the start of the buffer."""
+        # deleting from the front of a bytearray does not move the remaining data
+        del self.buffer[:num_bytes]
+        self.scan_pos = max(0, self.scan_pos - num_bytes)
+
+    def _find_end(self):
+        """Return the position of the first end marker in the buffer, or -1 if there is none."""
+        pos = self.buffer.find(0x02, self.scan_pos)
+        self.scan_pos = len(self.buffer) if pos < 0 else pos
+        return pos
+
+    def starts_with_garbage(self):
+        """Check if the buffer starts with data other than a message."""
+        return len(self.buffer) > 0 and self.buffer[0] != 0x01
+
+    def has_message(self):
+        """Check if there is a complete message *or leading garbage data* in the buffer."""
+        if len(self.buffer) == 0:
+            return False
+        return self.buffer[0] != 0x01 or self._find_end() >= 0
+
+    def remove_garbage(self):
+        """Remove the data from the buffer that is not the start of a message. Returns it as bytes."""
+        pos = self.buffer.find(0x01)
+        if pos < 0:
+            pos = len(self.buffer)
+        res = bytes(self.buffer[:pos])
+        self.garbage_bytes += pos
+        self._discard(pos)
+        return res
+
+    def remove_message(self):
+        """Remove a message from the buffer and return it as bytes. Assumes it has been checked
+        that there is a complete message without leading garbage data"""
+        pos = self._find_end()
+        if pos < 0:
+            raise Exception('There is no message')
+        res = bytes(self.buffer[:pos + 1])
+        self._discard(pos + 1)
+        return res
+
+    def clear(self):
+        """Drop all data currently in the buffer."""
+        self._discard(len(self.buffer))
+
+    def iter_messages(self):
+        """Yield the decoded payloads (bytes) of the complete messages in the buffer, removing
+        them. Garbage and messages that cannot be decoded are dropped and counted."""
+        while len(self.buffer) > 0:
+            if self.buffer[0] != 0x01:
+                self.remove_garbage()
+                continue
+            pos = self._find_end()
+            if pos < 0:
+                return
+            # a start marker inside the message means the data before it was truncated
+            start = self.buffer.rfind(0x01, 1, pos)
+            if start > 0:
+                self.garbage_bytes += start
+                self._discard(start)
+            msg = self.remove_message()
+            try:
+                payload = self.messages.decode_bytes(msg)
+            except Exception:
+                self.bad_messages += 1
+                continue
+            yield payload
@@ -1,8 +1,81 @@
 """ Provides Message class to construct messages for the TimeBox """
 
+from collections import OrderedDict
+from itertools import chain
+from time import perf_counter
+from gamma import gamma_table
+
+# translation tables to mask a byte to its lower nibble, to move the lower nibble up and
+# to move the higher nibble down
+_LOW_NIBBLE = bytes(k & 0x0f for k in range(256))
+_HIGH_NIBBLE = bytes((k & 0x0f) << 4 for k in range(256))
+_HIGH_TO_LOW_NIBBLE = bytes(k >> 4 for k in range(256))
+
 class TimeBoxMessages:
     """Support the formation of messages to communicatie with the TimeBox."""
 
+    COMMANDS = {
+        "switch radio": 0x05,
+        "set volume": 0x08,
+        "get volume": 0x09,
+        "set mute": 0x0a,
+        "get mute": 0x0b,
+        "set date time": 0x18,
+        "set image": 0x44,
+        "set view": 0x45,
+        "set animation frame": 0x49,
+        "get temperature": 0x59,
+        "get radio frequency": 0x60,
+        "set radio frequency": 0x61
+    }
+
+    STATIC_IMAGE_HEADER = bytes([0xbd, 0x00, 0x44, 0x00, 0x0a, 0x0a, 0x04])
+    DYNAMIC_IMAGE_HEADER = bytes([0xbf, 0x00, 0x49, 0x00, 0x0a, 0x0a, 0x04])
+
+    frame_buf = None
+
+    # Metrics object recording the pack and escape stages, see TimeBox.enable_metrics
+    metrics = None
+
+    # cache of encoded image messages, see enable_cache
+    cache = None
+    cache_max_entries = None
+    cache_max_bytes = None
+    cache_bytes = 0
+    cache_hits = 0
+    cache_misses = 0
+    cache_evictions = 0
+
+    def enable_cache(self, max_entries=64, max_bytes=None):
+        """Cache the encoded image messages, keyed by the image content, so repeated images
+        are not packed, checksummed and escaped again. The least recently used messages are
+        evicted when there are more than max_entries, or when the messages and keys take more
+        than max_bytes bytes (if not None). The key of a TimeBoxImage is taken from its nested
+        lists once per change (see TimeBoxImage.pixel_bytes), which costs about half an
+        encode: the cache pays off for images sent again without changes, for
+        TimeBoxArrayImages and for bytes, less so for images built anew every frame. While
+        the cache is enabled, a TimeBoxImage whose lists are changed directly rather than
+        with put_pixel must be told with TimeBoxImage.changed."""
+        self.cache = OrderedDict()
+        self.cache_max_entries = max_entries
+        self.cache_max_bytes = max_bytes
+        self.cache_bytes = 0
+
+    def disable_cache(self):
+        """Stop caching image messages and drop the cached messages."""
+        self.cache = None
+        self.cache_bytes = 0
+
+    def cache_stats(self):
+        """Return the cache statistics as a dict."""
+        return {
+            'entries': 0 if self.cache is None else len(self.cache),
+            'bytes': self.cache_bytes,
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'evictions': self.cache_evictions,
+        }
+
     def checksum(self, payload):
         """Compute the payload checksum. Returned as list with LSM, MSB"""
         csum = sum(payload)
@@ -13,40 +86,50 @@ class TimeBoxMessages:
     def escape_payload(self, payload):
         """Escape the payload. It is not allowed to have occurrences of the codes
         0x01, 0x02 and 0x03. They mut be escaped by a leading 0x03 followed by 0x04,
-        0x05 or 0x06 respectively"""
-        escpayload = []
-        for payload_data in payload:
-            escpayload += \
-                [0x03, payload_data + 0x03] if payload_data in range(0x01, 0x04) else [payload_data]
-        return escpayload
+        0x05 or 0x06 respectively. Returns a list, see escape_bytes."""
+        return list(self.escape_bytes(payload))
+
+    def escape_bytes(self, payload):
+        """Escape the payload (any bytes-like object) as escape_payload does. Returns bytes."""
+        # 0x03 must go first, as the other replacements introduce new 0x03 bytes
+        return bytes(payload).replace(b'\x03', b'\x03\x06') \
+            .replace(b'\x01', b'\x03\x04').replace(b'\x02', b'\x03\x05')
 
     def unescape(self, data):
-        """unescape the data. """
-        unesc = []
-        _unescape_next = False
-        for _item in data:
-            if _unescape_next:
-                if _item < 0x04 or _item > 6:
-                    raise Exception('Error in escaped sequence.')
-                unesc.append(_item - 0x03)
-                _unescape_next = False
-            else:
-                if _item == 0x03:
-                    _unescape_next = True
-                else:
-                    unesc.append(_item)
-        return unesc
+        """unescape the data. Returns a list, see unescape_bytes."""
+        return list(self.unescape_bytes(data))
+
+    def unescape_bytes(self, data):
+        """unescape the data (any bytes-like object, e.g. a memoryview). Returns bytes."""
+        data = bytes(data)
+        # every 0x03 must start one of the three escape sequences
+        if data.count(b'\x03') != data.count(b'\x03\x04') + data.count(b'\x03\x05') + \
+                data.count(b'\x03\x06'):
+            raise Exception('Error in escaped sequence.')
+        # 0x03 0x06 must go last, as the other replacements could otherwise
+        # match the 0x03 it produces
+        return data.replace(b'\x03\x04', b'\x01').replace(b'\x03\x05', b'\x02') \
+            .replace(b'\x03\x06', b'\x03')
 
     def decode(self, msg):
         """remove leading 1, trailing 2 and checksum and un-escape. Return 'error' if
-        msg is not a correctmessage """
+        msg is not a correctmessage. Returns a list, see decode_bytes."""
+        return list(self.decode_bytes(msg))
+
+    def decode_bytes(self, msg):
+        """remove leading 1, trailing 2 and checksum and un-escape msg (any bytes-like
+        object, e.g. a memoryview). Raises an exception if msg is not a correct message.
+        Returns bytes."""
+        msg = memoryview(bytes(msg))
         if len(msg) < 4:
             raise Exception('error: too short')
         if msg[0] != 0x01 or msg[-1] != 0x02:
             raise Exception('error: no delimiters')
-        unesc = self.unescape(msg[1:-1])
-        csum = self.checksum(unesc[0:-2])
-        if csum != unesc[-2:]:
+        unesc = self.unescape_bytes(msg[1:-1])
+        if len(unesc) < 2:
+            raise Exception('error: too short')
+        csum = sum(memoryview(unesc)[:-2])
+        if unesc[-2] != csum & 0xff or unesc[-1] != (csum >> 8) & 0xff:
             raise Exception('error: wrong checksum')
         return unesc[:-2]
 
@@ -56,44 +139,121 @@ class TimeBoxMessages:
 
     def make_message(self, payload):
         """Make a complete message from the paload data. Add leading 0x01 and
-        trailing check sum and 0x02 and escape the payload"""
-        cs_payload = self._extend_with_checksum(payload)
-        escaped_payload = self.escape_payload(cs_payload)
-        return [0x01] + escaped_payload + [0x02]
+        trailing check sum and 0x02 and escape the payload. Returns a list, see
+        frame_message."""
+        return list(self.frame_message(payload))
+
+    def frame_message(self, payload, out=None):
+        """Make a complete message from the payload (any bytes-like object) like
+        make_message, but write it into the bytearray out. If out is not given, a
+        buffer owned by this object is reused for every message. Returns a memoryview
+        on the message, which is only valid until the buffer is written again."""
+        metrics = self.metrics
+        if metrics is not None:
+            start = perf_counter()
+        payload = bytes(payload)
+        csum = sum(payload)
+        escaped = self.escape_bytes(payload)
+        escaped_csum = self.escape_bytes(bytes([csum & 0xff, (csum >> 8) & 0xff]))
+        length = len(escaped) + len(escaped_csum) + 2
+        if out is None:
+            if self.frame_buf is None or len(self.frame_buf) < length:
+                self.frame_buf = bytearray(max(length, 512))
+            out = self.frame_buf
+        elif len(out) < length:
+            raise ValueError('Output buffer too small for message')
+        end = len(escaped) + 1
+        out[0] = 0x01
+        out[1:end] = escaped
+        out[end:length - 1] = escaped_csum
+        out[length - 1] = 0x02
+        if metrics is not None:
+            metrics.observe('escape_seconds', perf_counter() - start)
+            metrics.count('payload_bytes', len(payload))
+            metrics.count('escaped_bytes', length)
+        return memoryview(out)[:length]
+
+    def pack_nibbles(self, data):
+        """Pack a sequence of 4 bit values into bytes, two values per byte, the first
+        value in the lowest four bits. Higher bits of the values are ignored."""
+        data = bytes(data)
+        if len(data) & 1:
+            data += b'\x00'
+        low = data[0::2].translate(_LOW_NIBBLE)
+        high = data[1::2].translate(_HIGH_NIBBLE)
+        # combine all nibbles at once by or-ing the byte strings as (large) integers
+        return (int.from_bytes(low, 'little') | int.from_bytes(high, 'little')) \
+            .to_bytes(len(low), 'little')
+
+    def unpack_nibbles(self, data, count=None):
+        """Unpack bytes in the 4 bit wire format into the values, the inverse of pack_nibbles.
+        Returns the first count values (all if count is None) as bytes."""
+        data = bytes(data)
+        values = bytearray(2 * len(data))
+        values[0::2] = data.translate(_LOW_NIBBLE)
+        values[1::2] = data.translate(_HIGH_TO_LOW_NIBBLE)
+        return bytes(values[:count])
+
+    def pixel_data(self, imag):
+        """Return the color values (0-15) of the image as bytes, row by row, RGB per pixel.
+        imag can be a TimeBoxImage, a TimeBoxArrayImage or a buffer with the values
+        already in this layout (such as a contiguous uint8 numpy array)."""
+        data = getattr(imag, 'image', imag)
+        if isinstance(data, list):
+            return bytes(chain.from_iterable(chain.from_iterable(data)))
+        return bytes(data)
+
+    def quantize_rgb(self, data, gamma=None):
+        """Map 8 bit RGB data (a bytes-like object, row by row, RGB per pixel) to the color
+        values (0-15) of the TimeBox, gamma corrected if gamma is given. Returns bytes."""
+        return bytes(data).translate(gamma_table(gamma))
+
+    def pack_rgb(self, data, gamma=None):
+        """Gamma correct, quantize and pack 8 bit RGB data into the 4 bit wire format, with
+        whole-buffer byte operations only. Returns bytes."""
+        if self.metrics is None:
+            return self.pack_nibbles(self.quantize_rgb(data, gamma))
+        start = perf_counter()
+        packed = self.pack_nibbles(self.quantize_rgb(data, gamma))
+        self.metrics.observe('pack_seconds', perf_counter() - start)
+        return packed
+
+    def pack_image(self, imag):
+        """Pack the image into the 4 bit wire format used in image messages. Returns bytes."""
+        if self.metrics is None:
+            return self.pack_nibbles(self.pixel_data(imag))
+        start = perf_counter()
+        packed = self.pack_nibbles(self.pixel_data(imag))
+        self.metrics.observe('pack_seconds', perf_counter() - start)
+        return packed
 
     def static_image_payload(self, imag):
         """Create the message payload for the image."""
-        resmsg = [0] * (((imag.height * imag.width * 3 + 1) >> 1) + 7)
-        resmsg[0:7] = [0xbd, 0x00, 0x44, 0x00, 0x0a, 0x0a, 0x04]
-
-        # nibble index to write next pixel value
-        nix = 14
-        for yix in range(imag.height):
-            for xix in range(imag.width):
-                for cix in range(3):
-                    pdat = imag.get_pixel_data(xix, yix, cix)
-                    if nix&1 != 0:
-                        pdat = pdat << 4
-                    resmsg[nix>>1] |= pdat
-                    nix = nix + 1
-        return resmsg
+        return list(self.static_image_bytes(imag))
+
+    def static_image_bytes(self, imag):
+        """Create the message payload for the image as bytes."""
+        return self.STATIC_IMAGE_HEADER + self.pack_image(imag)
 
     def dynamic_image_payload(self, imag, frame_num, frame_delay):
         """Create the message payload for the image in an animation."""
-        resmsg = [0] * 191
-        resmsg[0:9] = [0xbf, 0x00, 0x49, 0x00, 0x0a, 0x0a, 0x04, frame_num, frame_delay]
-
-        # nibble index to write next pixel value
-        nix = 18
-        for yix in range(imag.width):
-            for xix in range(imag.height):
-                for cix in range(3):
-                    pdat = imag.get_pixel_data(xix, yix, cix)
-                    if nix&1 != 0:
-                        pdat = pdat << 4
-                    resmsg[nix>>1] |= pdat
-                    nix = nix + 1
-        return resmsg
+        return list(self.dynamic_image_bytes(imag, frame_num, frame_delay))
+
+    def dynamic_image_bytes(self, imag, frame_num, frame_delay):
+        """Create the message payload for the image in an animation as bytes."""
+        return self.DYNAMIC_IMAGE_HEADER + bytes([frame_num, frame_delay]) + self.pack_image(imag)
+
+    def command_payload(self, command, args=None):
+        """Create the payload for a command (number or name from COMMANDS) with optional
+        arguments, prefixed with the command length."""
+        if args is None:
+            args = []
+        if isinstance(command, str):
+            command = self.COMMANDS[command]
+        length = len(args)+3
+        length_lsb = length & 0xff
+        length_msb = length >> 8
+        return [length_lsb, length_msb, command] + list(args)
 
     def command_message(self, command, arguments=None):
         """Make a message from a command number and optional arguments"""
@@ -102,10 +262,56 @@ class TimeBoxMessages:
             payload += arguments
         return self.make_message(payload)
 
+    def _image_frame(self, header, image):
+        """Create the message for an image with the payload header, from the cache if it
+        is enabled."""
+        if self.cache is None:
+            return self.frame_message(header + self.pack_image(image))
+        start = perf_counter()
+        if hasattr(image, 'pixel_bytes'):
+            pixels = image.pixel_bytes()
+        else:
+            pixels = self.pixel_data(image)
+        key = header + pixels
+        msg = self.cache.get(key)
+        if msg is not None:
+            self.cache.move_to_end(key)
+            self.cache_hits += 1
+            return msg
+        self.cache_misses += 1
+        packed = self.pack_nibbles(pixels)
+        if self.metrics is not None:
+            self.metrics.observe('pack_seconds', perf_counter() - start)
+        msg = bytes(self.frame_message(header + packed))
+        self.cache[key] = msg
+        self.cache_bytes += len(key) + len(msg)
+        while len(self.cache) > self.cache_max_entries or \
+                (self.cache_max_bytes is not None and self.cache_bytes > self.cache_max_bytes):
+            old_key, old_msg = self.cache.popitem(last=False)
+            self.cache_bytes -= len(old_key) + len(old_msg)
+            self.cache_evictions += 1
+        return msg
+
     def static_image_message(self, image):
         """Creates a static image message from a TimeBoxImage."""
-        return self.make_message(self.static_image_payload(image))
+        return list(self.static_image_frame(image))
+
+    def static_image_frame(self, image):
+        """Creates a static image message from a TimeBoxImage as a bytes-like object: either
+        in the reused frame buffer (see frame_message) or, if enabled, from the cache."""
+        return self._image_frame(self.STATIC_IMAGE_HEADER, image)
+
+    def static_rgb_frame(self, data, gamma=None):
+        """Creates a static image message from 8 bit RGB data (see pack_rgb), in the reused
+        frame buffer (see frame_message)."""
+        return self.frame_message(self.STATIC_IMAGE_HEADER + self.pack_rgb(data, gamma))
 
     def dynamic_image_message(self, image, frame_num, frame_delay):
         """Creates a static image message from a TimeBoxImage."""
-        return self.make_message(self.dynamic_image_payload(image, frame_num, frame_delay))
+        return list(self.dynamic_image_frame(image, frame_num, frame_delay))
+
+    def dynamic_image_frame(self, image, frame_num, frame_delay):
+        """Creates an animation frame message from a TimeBoxImage as a bytes-like object:
+        either in the reused frame buffer (see frame_message) or, if enabled, from the cache."""
+        return self._image_frame(self.DYNAMIC_IMAGE_HEADER + bytes([frame_num, frame_delay]),
+                                 image)
@@ -0,0 +1,215 @@
+"""Provides class Metrics to collect counters and latency histograms of the stages of
+sending images to the TimeBox, and class PrometheusTextFile to export them."""
+
+import os
+import bisect
+import tempfile
+import threading
+from time import monotonic, perf_counter
+
+class Histogram:
+    """A histogram of durations in seconds, with fixed bucket bounds."""
+
+    # upper bounds of the buckets, from 10 microseconds to 2.5 seconds
+    BOUNDS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2,
+              5e-2, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+    bounds = None
+    # counts per bucket; the last one counts the values above all bounds
+    counts = None
+    count = 0
+    total = 0.0
+    max = 0.0
+
+    def __init__(self, bounds=BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+
+    def observe(self, value):
+        """Count the duration value."""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self):
+        """Return the histogram as a dict, with the buckets as list of (upper bound, number
+        of values up to it) pairs, cumulative as in Prometheus."""
+        buckets = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            cumulative += count
+            buckets.append((bound, cumulative))
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'buckets': buckets,
+        }
+
+
+class Metrics:
+    """Collects counters and latency histograms by name. TimeBox and TimeBoxMessages record
+    into a Metrics object once it is enabled with TimeBox.enable_metrics; while it is not,
+    they only check that their metrics attribute is None. These names are recorded:
+
+    counters: frames_sent, messages_sent, bytes_sent, send_calls, short_writes (sends that
+    took only part of the data), payload_bytes and escaped_bytes (before and after escaping
+    and framing), bytes_received
+    histograms: pack_seconds (image to wire format), escape_seconds (checksum, escaping and
+    framing), send_seconds (until the socket took the whole message, including waiting for
+    it to become writable), receive_seconds (waiting for and reading input)
+
+    Other stages, such as rendering, are timed by the caller with time(name). Gauges are
+    functions returning a value when a snapshot is taken, for statistics that are counted
+    elsewhere anyway. The snapshot is handed to the sinks (functions taking the snapshot
+    dict, such as a PrometheusTextFile) by report, which is also called every interval
+    seconds while durations are observed, if interval is not None. A Metrics object can
+    be shared by several TimeBoxes, for instance those of a TimeBoxGroup."""
+
+    counters = None
+    histograms = None
+    gauges = None
+    sinks = None
+    lock = None
+
+    interval = None
+    next_report = None
+
+    def __init__(self, sinks=(), interval=None):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.sinks = list(sinks)
+        self.lock = threading.Lock()
+        self.interval = interval
+        if interval is not None:
+            self.next_report = monotonic() + interval
+
+    def add_sink(self, sink):
+        """Add the function sink, which report calls with the snapshot."""
+        self.sinks.append(sink)
+
+    def add_gauge(self, name, func):
+        """Let the snapshot contain the value returned by func as gauge name."""
+        self.gauges[name] = func
+
+    def count(self, name, value=1):
+        """Add value to the counter name."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        """Count the duration seconds in the histogram name."""
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+        if self.next_report is not None and monotonic() >= self.next_report:
+            self.next_report = monotonic() + self.interval
+            self.report()
+
+    def time(self, name):
+        """Return a context manager that observes the time spent in it in the histogram
+        name, for instance
+            with metrics.time('render_seconds'):
+                image = render()"""
+        return _Timer(self, name)
+
+    def escape_ratio(self):
+        """The size of the sent messages relative to their payload (escaping and framing
+        overhead), 0.0 if nothing was sent."""
+        payload = self.counters.get('payload_bytes', 0)
+        return self.counters.get('escaped_bytes', 0) / payload if payload else 0.0
+
+    def snapshot(self):
+        """Return the counters, gauges and histograms as a dict."""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {name: histogram.snapshot()
+                          for name, histogram in self.histograms.items()}
+            gauges = {'escape_ratio': self.escape_ratio()}
+        for name, func in self.gauges.items():
+            gauges[name] = func()
+        return {'counters': counters, 'gauges': gauges, 'histograms': histograms}
+
+    def report(self):
+        """Hand a snapshot to all sinks. Returns the snapshot."""
+        snapshot = self.snapshot()
+        for sink in self.sinks:
+            sink(snapshot)
+        return snapshot
+
+    def reset(self):
+        """Clear all counters and histograms."""
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+
+class _Timer:
+    """Context manager of Metrics.time."""
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, perf_counter() - self.start)
+        return False
+
+
+class PrometheusTextFile:
+    """A sink of Metrics that writes the snapshot in the Prometheus text format to the file
+    fname, for instance for the textfile collector of the node exporter. The file is
+    replaced atomically, so a collector never reads it half written. The metric names are
+    prefixed with prefix; counters get the suffix _total."""
+
+    fname = None
+    prefix = None
+
+    def __init__(self, fname, prefix='timebox_'):
+        self.fname = fname
+        self.prefix = prefix
+
+    def format(self, snapshot):
+        """Return the snapshot in the Prometheus text format."""
+        lines = []
+        for name, value in sorted(snapshot['counters'].items()):
+            name = self.prefix + name + '_total'
+            lines.append('# TYPE %s counter' % name)
+            lines.append('%s %s' % (name, value))
+        for name, value in sorted(snapshot['gauges'].items()):
+            name = self.prefix + name
+            lines.append('# TYPE %s gauge' % name)
+            lines.append('%s %r' % (name, float(value)))
+        for name, histogram in sorted(snapshot['histograms'].items()):
+            name = self.prefix + name
+            lines.append('# TYPE %s histogram' % name)
+            for bound, count in histogram['buckets']:
+                bound = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('%s_bucket{le="%s"} %d' % (name, bound, count))
+            lines.append('%s_sum %r' % (name, histogram['sum']))
+            lines.append('%s_count %d' % (name, histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+    def __call__(self, snapshot):
+        """Write the snapshot to the file."""
+        directory = os.path.dirname(os.path.abspath(self.fname))
+        fd, tmp_name = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as file:
+                file.write(self.format(snapshot))
+            os.chmod(tmp_name, 0o644)
+            os.replace(tmp_name, self.fname)
+        except OSError:
+            os.unlink(tmp_name)
+            raise
@@ -0,0 +1,94 @@
+"""Provides class FramePacer and function run_at_fps to show frames at a steady rate."""
+
+from time import monotonic, sleep
+
+class FramePacer:
+    """Paces frames at a target rate. Each frame is due one frame period after the deadline
+    of the previous one, measured on the monotonic clock, so time spent rendering and
+    sending does not add to the frame period. When a frame is ready a full period or more
+    after its deadline, it is due immediately and the deadlines that were missed are
+    skipped (counted as dropped frames), so lag does not accumulate."""
+
+    period = None
+    next_deadline = None
+
+    frames = 0
+    dropped = 0
+
+    # statistics of the intervals between shown frames (Welford's algorithm)
+    last_time = None
+    intervals = 0
+    interval_mean = 0.0
+    interval_m2 = 0.0
+
+    def __init__(self, fps):
+        self.period = 1.0 / fps
+
+    def reset(self):
+        """Restart the schedule from the next frame, for instance after a deliberate pause.
+        The statistics are kept."""
+        self.next_deadline = None
+        self.last_time = None
+
+    def wait(self):
+        """Wait until the deadline of the next frame. Returns the number of deadlines that
+        were skipped because the frame was late, so callers that animate over time can
+        advance their animation accordingly."""
+        now = monotonic()
+        if self.next_deadline is None:
+            self.next_deadline = now
+        skipped = 0
+        late = now - self.next_deadline
+        if late >= self.period:
+            skipped = int(late / self.period)
+            self.next_deadline += skipped * self.period
+            self.dropped += skipped
+        elif late < 0.0:
+            sleep(-late)
+            now = monotonic()
+        self.next_deadline += self.period
+        self._record(now)
+        return skipped
+
+    def _record(self, now):
+        """Update the statistics for a frame shown at time now."""
+        self.frames += 1
+        if self.last_time is not None:
+            interval = now - self.last_time
+            self.intervals += 1
+            delta = interval - self.interval_mean
+            self.interval_mean += delta / self.intervals
+            self.interval_m2 += delta * (interval - self.interval_mean)
+        self.last_time = now
+
+    def fps(self):
+        """The achieved rate of shown frames."""
+        if self.interval_mean == 0.0:
+            return 0.0
+        return 1.0 / self.interval_mean
+
+    def jitter(self):
+        """The standard deviation of the intervals between shown frames, in seconds."""
+        if self.intervals < 2:
+            return 0.0
+        return (self.interval_m2 / (self.intervals - 1)) ** 0.5
+
+    def stats(self):
+        """Return the frame statistics as a dict."""
+        return {
+            'frames': self.frames,
+            'dropped': self.dropped,
+            'fps': self.fps(),
+            'jitter': self.jitter(),
+        }
+
+
+def run_at_fps(frames, fps, show):
+    """Take frames from the iterable frames and pass them to show (for instance
+    TimeBox.set_static_image) at the rate fps, skipping deadlines when frames are late (see
+    FramePacer). Returns the frame statistics when frames is exhausted."""
+    pacer = FramePacer(fps)
+    for frame in frames:
+        pacer.wait()
+        show(frame)
+    return pacer.stats()
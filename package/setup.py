@@ -3,5 +3,7 @@ setup(name='timebox',
       version='0.1',
       package_dir = {'': 'package'},
       package_data = {'examples/fonts': ['*']},
-      py_modules=['timebox', 'timeboximage', 'messages', 'utils/fonts', 'utils/gifreader'],
+      py_modules=['timebox', 'timeboximage', 'messages', 'messageparser', 'asynctimebox',
+                  'timeboxgroup', 'videowall', 'simulator', 'pacing', 'bundle', 'gamma',
+                  'metrics', 'utils/fonts', 'utils/gifreader'],
       )
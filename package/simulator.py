@@ -0,0 +1,268 @@
+"""Provides class TimeBoxSimulator, a stand-in for a TimeBox on a local socket, to test and
+benchmark clients without bluetooth hardware. Run as a script to listen on a TCP port or a
+unix socket:
+    PYTHONPATH=package python package/simulator.py --tcp 127.0.0.1:7777 --bandwidth 40000
+"""
+
+import argparse
+import queue
+import socket
+import threading
+from time import monotonic, sleep
+from messages import TimeBoxMessages
+from messageparser import MessageParser
+
+class TimeBoxSimulator:
+    """Class TimeBoxSimulator receives messages like a TimeBox (see doc/protocol.md). It
+    greets a new connection with HELLO, checks the checksum and length of every message,
+    answers commands with an acknowledgement and keeps the image shown. A bandwidth (bytes
+    per second) limits how fast data is taken from the connection, and a latency (seconds)
+    delays the responses, to come close to a bluetooth connection."""
+
+    HELLO = bytes([0x00, 0x05, 0x48, 0x45, 0x4c, 0x4c, 0x4f, 0x00])
+    WIDTH = 11
+    HEIGHT = 11
+    IMAGE_COMMANDS = (0x44, 0x49)
+
+    bandwidth = None
+    latency = 0.0
+    hello = True
+    respond = True
+
+    messages = None
+    parser = None
+    responses = None
+
+    # the image shown: color values (0-15) row by row, RGB per pixel
+    frame = None
+    # the frames of the animation being sent, by frame number
+    animation = None
+    view = None
+
+    bytes_received = 0
+    messages_received = 0
+    images_received = 0
+    bad_length = 0
+    responses_dropped = 0
+    first_data_time = None
+    last_data_time = None
+    first_image_time = None
+    last_image_time = None
+
+    def __init__(self, bandwidth=None, latency=0.0, hello=True, respond=True):
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.hello = hello
+        self.respond = respond
+        self.messages = TimeBoxMessages()
+        self.frame = bytes(3 * self.WIDTH * self.HEIGHT)
+        self.reset()
+
+    def reset(self):
+        """Start the statistics and the input buffer anew, as for a new connection. The
+        image shown is kept."""
+        self.parser = MessageParser(1 << 16, self.messages)
+        self.animation = {}
+        self.bytes_received = 0
+        self.messages_received = 0
+        self.images_received = 0
+        self.bad_length = 0
+        self.responses_dropped = 0
+        self.first_data_time = None
+        self.last_data_time = None
+        self.first_image_time = None
+        self.last_image_time = None
+
+    def serve(self, sock):
+        """Act as TimeBox on the connected socket sock until the peer closes it. The
+        statistics (see stats) cover this connection only."""
+        self.reset()
+        if self.bandwidth is not None:
+            # a small receive buffer lets the limit slow down the sender soon
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        self.responses = queue.Queue(256)
+        responder = threading.Thread(target=self._respond_loop, args=(sock,),
+                                     name='TimeBoxSimulator responder')
+        responder.daemon = True
+        responder.start()
+        if self.hello:
+            self._queue_response(self.HELLO)
+        chunk = 4096 if self.bandwidth is None else max(1, min(4096, self.bandwidth // 100))
+        next_time = monotonic()
+        try:
+            while True:
+                try:
+                    data = sock.recv(chunk)
+                except OSError:
+                    break
+                if not data:
+                    break
+                now = monotonic()
+                self._received(data, now)
+                if self.bandwidth is not None:
+                    next_time = max(next_time, now) + len(data) / float(self.bandwidth)
+                    if next_time > now:
+                        sleep(next_time - now)
+        finally:
+            self.responses.put(None)
+            responder.join()
+            sock.close()
+
+    def start(self, sock):
+        """Serve the connected socket sock in a background thread. Returns the thread."""
+        thread = threading.Thread(target=self.serve, args=(sock,), name='TimeBoxSimulator')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def socketpair(self):
+        """Create a connected pair of sockets, serve one end in a background thread and
+        return the other, for instance to pass to TimeBox.connect(sock=...)."""
+        client, device = socket.socketpair()
+        self.start(device)
+        return client
+
+    def listen(self, address, family=socket.AF_INET, served=None):
+        """Listen on address (a (host, port) tuple for AF_INET, a path for AF_UNIX) and serve
+        the connections one after the other, like a TimeBox does. served is called after
+        each connection, if given, and can read the statistics of that connection. Does not
+        return."""
+        server = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(address)
+        server.listen(1)
+        try:
+            while True:
+                conn, _ = server.accept()
+                self.serve(conn)
+                if served is not None:
+                    served()
+        finally:
+            server.close()
+
+    def _queue_response(self, data):
+        """Queue data to be sent latency seconds from now. Responses are dropped if the
+        client does not read them."""
+        try:
+            self.responses.put_nowait((monotonic() + self.latency, data))
+        except queue.Full:
+            self.responses_dropped += 1
+
+    def _respond_loop(self, sock):
+        """Main loop of the responder thread."""
+        while True:
+            item = self.responses.get()
+            if item is None:
+                return
+            due, data = item
+            delay = due - monotonic()
+            if delay > 0.0:
+                sleep(delay)
+            try:
+                sock.sendall(data)
+            except OSError:
+                return
+
+    def _received(self, data, now):
+        """Handle data received at time now."""
+        if self.first_data_time is None:
+            self.first_data_time = now
+        self.last_data_time = now
+        self.bytes_received += len(data)
+        self.parser.feed(data)
+        for payload in self.parser.iter_messages():
+            self._handle(payload, now)
+
+    def _handle(self, payload, now):
+        """Handle a decoded message payload received at time now."""
+        # the payload starts with its own length, LSB first, then the command
+        if len(payload) < 3 or payload[0] + (payload[1] << 8) != len(payload):
+            self.bad_length += 1
+            return
+        self.messages_received += 1
+        command = payload[2]
+        if command == 0x44:
+            self.frame = self._image(payload[7:])
+        elif command == 0x49:
+            self.animation[payload[7]] = self._image(payload[9:])
+            self.frame = self.animation[payload[7]]
+        elif command == 0x45:
+            self.view = bytes(payload[3:])
+        if command in self.IMAGE_COMMANDS:
+            self.images_received += 1
+            if self.first_image_time is None:
+                self.first_image_time = now
+            self.last_image_time = now
+        if self.respond:
+            ack = bytes([0x05, 0x00, 0x04, command, 0x55])
+            self._queue_response(bytes(self.messages.frame_message(ack)))
+
+    def _image(self, data):
+        """Return the color values of the pixels of the image data of a message."""
+        return self.messages.unpack_nibbles(data, 3 * self.WIDTH * self.HEIGHT)
+
+    def get_pixel(self, xix, yix):
+        """Return the color (values 0-15) of pixel (xix, yix) of the image shown as list of
+        R, G and B."""
+        off = 3 * (yix * self.WIDTH + xix)
+        return list(self.frame[off:off+3])
+
+    def save_png(self, fname, scale=10):
+        """Save the image shown as PNG file, every pixel scale x scale pixels large.
+        Requires Pillow."""
+        from PIL import Image
+        image = Image.frombytes('RGB', (self.WIDTH, self.HEIGHT),
+                                bytes(17 * val for val in self.frame))
+        image.resize((scale * self.WIDTH, scale * self.HEIGHT), Image.NEAREST).save(fname)
+
+    def stats(self):
+        """Return the statistics of the received data as a dict. The throughput (bytes per
+        second) and the frame rate are taken over the time between the first and the last
+        data and images received."""
+        duration = (self.last_data_time - self.first_data_time) if self.bytes_received else 0.0
+        image_time = (self.last_image_time - self.first_image_time) \
+            if self.images_received else 0.0
+        return {
+            'bytes': self.bytes_received,
+            'messages': self.messages_received,
+            'images': self.images_received,
+            'bad_checksum': self.parser.bad_messages,
+            'bad_length': self.bad_length,
+            'garbage_bytes': self.parser.garbage_bytes,
+            'responses_dropped': self.responses_dropped,
+            'throughput': self.bytes_received / duration if duration > 0.0 else 0.0,
+            'fps': (self.images_received - 1) / image_time if image_time > 0.0 else 0.0,
+        }
+
+
+def main():
+    """Run the simulator on a TCP port or a unix socket."""
+    parser = argparse.ArgumentParser(description='Simulate a TimeBox on a local socket.')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--tcp', help='listen on HOST:PORT')
+    group.add_argument('--unix', help='listen on the unix socket PATH')
+    parser.add_argument('--bandwidth', type=int, help='bytes per second taken in')
+    parser.add_argument('--latency', type=float, default=0.0, help='response delay in s')
+    parser.add_argument('--png', help='save the image shown to PNG when a client leaves')
+    args = parser.parse_args()
+
+    simulator = TimeBoxSimulator(args.bandwidth, args.latency)
+
+    def report():
+        """Report on the connection that was served."""
+        print(simulator.stats())
+        if args.png:
+            simulator.save_png(args.png)
+    try:
+        if args.tcp:
+            host, port = args.tcp.rsplit(':', 1)
+            simulator.listen((host, int(port)), served=report)
+        else:
+            simulator.listen(args.unix, socket.AF_UNIX, served=report)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,82 +1,222 @@
 """Provides class TimeBox that encapsulates the TimeBox communication."""
 
+import queue
 import select
+import threading
+from time import monotonic, perf_counter
 from bluetooth import BluetoothSocket, RFCOMM
 from messages import TimeBoxMessages
+from messageparser import MessageParser
+from bundle import Bundle
+from pacing import FramePacer
+from metrics import Metrics
 
 class TimeBox:
     """Class TimeBox encapsulates the TimeBox communication."""
     
     DEFAULTHOST = "11:75:58:48:2F:DA"
 
-    COMMANDS = {
-        "switch radio": 0x05,
-        "set volume": 0x08,
-        "get volume": 0x09,
-        "set mute": 0x0a,
-        "get mute": 0x0b,
-        "set date time": 0x18,
-        "set image": 0x44,
-        "set view": 0x45,
-        "set animation frame": 0x49,
-        "get temperature": 0x59,
-        "get radio frequency": 0x60,
-        "set radio frequency": 0x61
-    }
+    COMMANDS = TimeBoxMessages.COMMANDS
 
     socket = None
     messages = None
-    message_buf = []
+    parser = None
 
-    def __init__(self):
+    # background reader thread, see start_reader
+    reader = None
+    reader_stop = None
+    received = None
+    dropped_messages = 0
+
+    # skipping of unchanged static images, see set_skip_unchanged
+    skip_unchanged = False
+    keepalive_interval = None
+    last_image = None
+    last_image_time = None
+    last_image_size = 0
+    frames_skipped = 0
+    bytes_saved = 0
+
+    # Metrics object recording the stages of sending, see enable_metrics
+    metrics = None
+
+    def __init__(self, max_buffer_size=MessageParser.DEFAULT_MAX_SIZE):
         self.messages = TimeBoxMessages()
+        self.parser = MessageParser(max_buffer_size, self.messages)
 
-    def connect(self, host=None, port=4):
-        """Open a connection to the TimeBox."""
-        # Create the client socket
-        if host is None:
-            host = self.DEFAULTHOST
-        #print("connecting to %s at %s" % (self.host, self.port))
-        self.socket = BluetoothSocket(RFCOMM)
-        self.socket.connect((host, port))
+    @property
+    def message_buf(self):
+        """The data in the input buffer, as a list."""
+        return list(self.parser.buffer)
+
+    def connect(self, host=None, port=4, reader=False, sock=None):
+        """Open a connection to the TimeBox, or use the connected stream socket sock instead
+        (for instance one end of a socketpair or a TCP connection). If reader is True, start
+        a background thread reading the input from the TimeBox (see start_reader)."""
+        if sock is None:
+            # Create the client socket
+            if host is None:
+                host = self.DEFAULTHOST
+            #print("connecting to %s at %s" % (self.host, self.port))
+            sock = BluetoothSocket(RFCOMM)
+            sock.connect((host, port))
+        self.socket = sock
         self.socket.setblocking(0)
+        if reader:
+            self.start_reader()
 
     def close(self):
         """Closes the connection to the TimeBox."""
+        self.stop_reader()
         self.socket.close()
 
+    def enable_metrics(self, metrics=None):
+        """Record counters and latency histograms of the stages of sending and receiving
+        (see Metrics) into metrics, or into a new Metrics object if metrics is None. The
+        statistics of the input parser and of skipping unchanged images are added as gauges.
+        Returns the Metrics object."""
+        if metrics is None:
+            metrics = Metrics()
+        metrics.add_gauge('garbage_bytes', lambda: self.parser.garbage_bytes)
+        metrics.add_gauge('bad_messages', lambda: self.parser.bad_messages)
+        metrics.add_gauge('dropped_messages', lambda: self.dropped_messages)
+        metrics.add_gauge('frames_skipped', lambda: self.frames_skipped)
+        self.metrics = metrics
+        self.messages.metrics = metrics
+        return metrics
+
+    def disable_metrics(self):
+        """Stop recording metrics."""
+        self.metrics = None
+        self.messages.metrics = None
+
+    def start_reader(self, max_messages=256):
+        """Start a background thread that continuously reads the input from the TimeBox and
+        queues the decoded messages, keeping at most max_messages (older ones are dropped).
+        While it runs, clearing the input buffer never waits for input and received messages
+        are obtained with received_messages or get_message."""
+        if self.reader is not None:
+            return
+        self.received = queue.Queue(max_messages)
+        self.reader_stop = threading.Event()
+        self.reader = threading.Thread(target=self._read_loop, name='TimeBox reader')
+        self.reader.daemon = True
+        self.reader.start()
+
+    def stop_reader(self):
+        """Stop the background reader thread, if it is running."""
+        if self.reader is None:
+            return
+        self.reader_stop.set()
+        self.reader.join()
+        self.reader = None
+
+    def _read_loop(self):
+        """Main loop of the background reader thread."""
+        while not self.reader_stop.is_set():
+            try:
+                if self.receive() == 0:
+                    continue
+            except (OSError, ValueError):
+                # the connection was closed
+                return
+            for payload in self.parser.iter_messages():
+                self._queue_message(payload)
+
+    def _queue_message(self, payload):
+        """Queue a message received by the reader thread, dropping the oldest if the queue
+        is full."""
+        while True:
+            try:
+                self.received.put_nowait(payload)
+                return
+            except queue.Full:
+                try:
+                    self.received.get_nowait()
+                    self.dropped_messages += 1
+                except queue.Empty:
+                    pass
+
+    def get_message(self, timeout=None):
+        """Wait for a message queued by the reader thread and return its decoded payload (bytes).
+        Returns None if no message arrived within timeout seconds."""
+        try:
+            return self.received.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
     def receive(self, num_bytes=1024):
         """Receive n bytes of data from the TimeBox and put it in the input buffer.
-        Returns the number of bytes received."""
+        Returns the number of bytes received, 0 if none arrived within 0.1 seconds.
+        Raises ConnectionError if the TimeBox closed the connection."""
+        metrics = self.metrics
+        if metrics is not None:
+            start = perf_counter()
         ready = select.select([self.socket], [], [], 0.1)
         if ready[0]:
             data = self.socket.recv(num_bytes)
-            self.message_buf += data
-            return len(data)
+            if not data:
+                # readable without data: the connection was closed
+                raise ConnectionError('Connection closed')
+            self.parser.feed(data)
         else:
-            return 0
+            data = b''
+        if metrics is not None:
+            metrics.observe('receive_seconds', perf_counter() - start)
+            metrics.count('bytes_received', len(data))
+        return len(data)
 
     def send_raw(self, data):
         """Send raw data to the TimeBox."""
-        return self.socket.send(data)
+        self.last_image = None
+        sent = self.socket.send(data)
+        if self.metrics is not None:
+            self.metrics.count('send_calls')
+            self.metrics.count('bytes_sent', sent)
+            if sent < len(data):
+                self.metrics.count('short_writes')
+        return sent
+
+    def send_all(self, data):
+        """Send all of data to the TimeBox. As the socket is non-blocking, a send may accept
+        only part of the data, so wait until the socket is writable before each send.
+        Returns the number of bytes sent."""
+        if self.metrics is not None:
+            return self._send_all_measured(data)
+        view = memoryview(data)
+        while len(view) > 0:
+            select.select([], [self.socket], [])
+            view = view[self.socket.send(view):]
+        return len(data)
+
+    def _send_all_measured(self, data):
+        """send_all, recording the send stage in the metrics."""
+        metrics = self.metrics
+        start = perf_counter()
+        view = memoryview(data)
+        calls = 0
+        while len(view) > 0:
+            select.select([], [self.socket], [])
+            sent = self.socket.send(view)
+            calls += 1
+            if sent < len(view):
+                metrics.count('short_writes')
+            view = view[sent:]
+        metrics.observe('send_seconds', perf_counter() - start)
+        metrics.count('send_calls', calls)
+        metrics.count('messages_sent')
+        metrics.count('bytes_sent', len(data))
+        return len(data)
 
     def send_payload(self, payload):
         """Send raw payload to the TimeBox. (Will be escaped, checksumed and
         messaged between 0x01 and 0x02."""
-        msg = self.messages.make_message(payload)
-        return self.socket.send(bytes(msg))
+        self.last_image = None
+        return self.send_all(self.messages.frame_message(payload))
 
     def send_command(self, command, args=None):
         """Send command with optional arguments"""
-        if args is None:
-            args = []
-        if isinstance(command, str):
-            command = self.COMMANDS[command]
-        length = len(args)+3
-        length_lsb = length & 0xff
-        length_msb = length >> 8
-        payload = [length_lsb, length_msb, command] + args
-        self.send_payload(payload)
+        self.send_payload(self.messages.command_payload(command, args))
 
     def decode(self, msg):
         """remove leading 1, trailing 2 and checksum and un-escape"""
@@ -84,53 +224,109 @@ class TimeBox:
 
     def has_message(self):
         """Check if there is a complete message *or leading garbage data* in the input buffer."""
-        if len(self.message_buf) == 0:
-            return False
-        if self.message_buf[0] != 0x01:
-            return True
-        #endmarks = [x for x in self.message_buf if x == 0x02]
-        #return  len(endmarks) > 0
-        return 0x02 in self.message_buf
+        return self.parser.has_message()
 
     def buffer_starts_with_garbage(self):
         """Check if the input buffer starts with data other than a message."""
-        if len(self.message_buf) == 0:
-            return False
-        return self.message_buf[0] != 0x01
+        return self.parser.starts_with_garbage()
 
     def remove_garbage(self):
         """Remove data from the input buffer that is not the start of a message."""
-        pos = self.message_buf.index(0x01) if 0x01 in self.message_buf else len(self.message_buf)
-        res = self.message_buf[0:pos]
-        self.message_buf = self.message_buf[pos:]
-        return res
+        return list(self.parser.remove_garbage())
 
     def remove_message(self):
         """Remove a message from the input buffer and return it. Assumes it has been checked that
         there is a complete message without leading garbage data"""
-        if not 0x02 in self.message_buf:
-            raise Exception('There is no message')
-        pos = self.message_buf.index(0x02) + 1
-        res = self.message_buf[0:pos]
-        self.message_buf = self.message_buf[pos:]
-        return res
+        return list(self.parser.remove_message())
+
+    def received_messages(self):
+        """Yield the decoded payloads (bytes) of the complete messages in the input buffer,
+        removing them from the buffer. Garbage data and corrupt messages are dropped.
+        If the reader thread runs, the messages it has queued are yielded instead."""
+        if self.reader is not None:
+            return self._iter_received()
+        return self.parser.iter_messages()
+
+    def _iter_received(self):
+        """Yield the messages queued by the reader thread, without waiting."""
+        while True:
+            try:
+                yield self.received.get_nowait()
+            except queue.Empty:
+                return
 
     def drop_message_buffer(self):
         """Drop all dat currently in the message buffer,"""
-        self.message_buf = []
+        self.parser.clear()
+
+    def set_skip_unchanged(self, skip=True, keepalive_interval=10.0):
+        """Let set_static_image skip images that are identical (after packing to 4 bits) to
+        the image last sent. An unchanged image is still sent when keepalive_interval seconds
+        have passed since it was last sent, if keepalive_interval is not None. The skipped
+        images are counted in frames_skipped and the bytes not sent in bytes_saved."""
+        self.skip_unchanged = skip
+        self.keepalive_interval = keepalive_interval
+        self.last_image = None
 
     def set_static_image(self, image):
         """Set the image on the TimeBox"""
-        msg = self.messages.static_image_message(image)
-        self.socket.send(bytes(msg))
+        if not self.skip_unchanged:
+            self.send_all(self.messages.static_image_frame(image))
+            self._count_frames(1)
+            return
+        self._send_static_payload(self.messages.static_image_bytes(image))
+
+    def _send_static_payload(self, payload):
+        """Send the static image message payload, unless it equals the last one sent and
+        the keepalive interval has not passed (see set_skip_unchanged)."""
+        now = monotonic()
+        if payload == self.last_image and (self.keepalive_interval is None or \
+                now - self.last_image_time < self.keepalive_interval):
+            self.frames_skipped += 1
+            self.bytes_saved += self.last_image_size
+            return
+        self.last_image_size = self.send_all(self.messages.frame_message(payload))
+        self._count_frames(1)
+        self.last_image = payload
+        self.last_image_time = now
+
+    def _count_frames(self, frames):
+        """Count frames sent images in the metrics, if enabled."""
+        if self.metrics is not None:
+            self.metrics.count('frames_sent', frames)
+
+    def set_static_rgb(self, data, gamma=None):
+        """Set the image on the TimeBox from 8 bit RGB data (a bytes-like object such as
+        Pillow's tobytes() or a uint8 numpy array, row by row), gamma corrected if gamma is
+        given."""
+        if not self.skip_unchanged:
+            self.send_all(self.messages.static_rgb_frame(data, gamma))
+            self._count_frames(1)
+            return
+        self._send_static_payload(self.messages.STATIC_IMAGE_HEADER +
+                                  self.messages.pack_rgb(data, gamma))
 
     def set_dynamic_images(self, images, frame_delay):
         """Set the image on the TimeBox"""
+        self.last_image = None
         fnum = 0
         for img in images:
-            msg = self.messages.dynamic_image_message(img, fnum, frame_delay)
+            self.send_all(self.messages.dynamic_image_frame(img, fnum, frame_delay))
             fnum = fnum + 1
-            self.socket.send(bytes(msg))
+        self._count_frames(fnum)
+
+    def play_bundle(self, fname):
+        """Send the messages of the bundle file fname (see doc/bundle.md) to the TimeBox.
+        Animation frames are sent as fast as the connection allows; static images are
+        shown one after the other with the delay of the bundle."""
+        self.last_image = None
+        with Bundle(fname) as bundle:
+            pacer = FramePacer(1000.0 / bundle.delay) if bundle.static and bundle.delay else None
+            for msg in bundle:
+                if pacer is not None:
+                    pacer.wait()
+                self.send_all(msg)
+            self._count_frames(bundle.frame_count)
 
     def show_temperature(self, color=None):
         """Show temperature on the TimeBox in Celsius"""
@@ -148,10 +344,17 @@ class TimeBox:
 
     def clear_input_buffer(self):
         """Read all input from TimeBox and remove from buffer. """
+        if self.reader is not None:
+            for _ in self._iter_received():
+                pass
+            return
         while self.receive() > 0:
             self.drop_message_buffer()
 
     def clear_input_buffer_quick(self):
         """Quickly read most input from TimeBox and remove from buffer. """
+        if self.reader is not None:
+            self.clear_input_buffer()
+            return
         while self.receive(512) == 512:
             self.drop_message_buffer()
@@ -0,0 +1,256 @@
+"""Provides class TimeBoxGroup to show the same content on several TimeBoxes."""
+
+import queue
+import select
+import threading
+from time import monotonic
+from timebox import TimeBox
+from messages import TimeBoxMessages
+
+class GroupMember:
+    """A TimeBox of a TimeBoxGroup, with the queue of messages still to be sent to it and the
+    thread sending them. When the queue is full, the oldest replaceable message (a static
+    image, which a newer image replaces anyway) is dropped, so a slow device falls behind on
+    its own. Other messages (commands, animations) are not dropped for a newer one: putting
+    them waits up to PUT_TIMEOUT seconds for room in the queue before giving up on the
+    device. After an error sending or encoding a message the device is disconnected: its
+    messages are dropped and error is set. The input from the device (the acknowledgements
+    of the messages) is read by the reader thread of its TimeBox, see TimeBox.start_reader."""
+
+    PUT_TIMEOUT = 1.0
+
+    name = None
+    timebox = None
+    queue = None
+    thread = None
+    stop = None
+    error = None
+    # called with the time a message was queued and the time it was sent, if set
+    on_sent = None
+
+    sent = 0
+    sent_bytes = 0
+    dropped = 0
+    # time from handing a message to the group until it was sent to the device
+    latency_last = 0.0
+    latency_total = 0.0
+    latency_max = 0.0
+
+    def __init__(self, name, timebox, max_queue):
+        self.name = name
+        self.timebox = timebox
+        self.queue = queue.Queue(max_queue)
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._send_loop, name='TimeBoxGroup ' + name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, data, queued_at, replaceable=False):
+        """Queue data. data can also be a function returning the data, which is then called
+        by the sender thread (to encode the message for this device concurrently with the
+        other devices). If the queue is full, the oldest replaceable message is dropped; if
+        there is none, a replaceable message is dropped itself and other messages wait for
+        room (see GroupMember)."""
+        item = (data, queued_at, replaceable)
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                if not self._drop_replaceable():
+                    break
+        if replaceable:
+            self.dropped += 1
+            return
+        try:
+            self.queue.put(item, timeout=self.PUT_TIMEOUT)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drop_replaceable(self):
+        """Remove the oldest replaceable message from the queue. Returns False if there is
+        none."""
+        with self.queue.mutex:
+            for index, (_, _, replaceable) in enumerate(self.queue.queue):
+                if replaceable:
+                    del self.queue.queue[index]
+                    break
+            else:
+                return False
+        self.queue.task_done()
+        self.dropped += 1
+        return True
+
+    def _send_loop(self):
+        """Main loop of the sender thread."""
+        while not self.stop.is_set():
+            try:
+                data, queued_at, _ = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            try:
+                if self.error is None:
+                    if callable(data):
+                        data = data()
+                    self._send(data)
+                    self._record(queued_at, len(data))
+                else:
+                    self.dropped += 1
+            except Exception as err:
+                # also errors of a function encoding the message, so the device fails
+                # visibly instead of ending the thread with messages still queued
+                self.error = err
+                self.dropped += 1
+            finally:
+                self.queue.task_done()
+
+    def _send(self, data):
+        """Send all of data, giving up when the group is closed."""
+        view = memoryview(data)
+        sock = self.timebox.socket
+        while len(view) > 0:
+            if self.stop.is_set():
+                raise ValueError('Group closed')
+            if select.select([], [sock], [], 0.1)[1]:
+                view = view[sock.send(view):]
+
+    def _record(self, queued_at, size):
+        """Update the statistics for a message sent now."""
+        now = monotonic()
+        latency = now - queued_at
+        self.sent += 1
+        self.sent_bytes += size
+        self.latency_last = latency
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        if self.on_sent is not None:
+            self.on_sent(queued_at, now)
+
+    def lag(self):
+        """The number of messages waiting to be sent to the device."""
+        return self.queue.qsize()
+
+    def lag_seconds(self):
+        """The time the oldest message waiting to be sent to the device has been queued."""
+        with self.queue.mutex:
+            if not self.queue.queue:
+                return 0.0
+            return monotonic() - self.queue.queue[0][1]
+
+    def stats(self):
+        """Return the statistics of the device as a dict."""
+        return {
+            'sent': self.sent,
+            'sent_bytes': self.sent_bytes,
+            'dropped': self.dropped,
+            'lag': self.lag(),
+            'lag_seconds': self.lag_seconds(),
+            'latency_last': self.latency_last,
+            'latency_mean': self.latency_total / self.sent if self.sent else 0.0,
+            'latency_max': self.latency_max,
+            'error': None if self.error is None else str(self.error),
+        }
+
+    def close(self):
+        """Stop the sender thread and close the connection."""
+        self.stop.set()
+        self.thread.join()
+        self.timebox.close()
+
+
+class TimeBoxGroup:
+    """Class TimeBoxGroup shows the same content on several TimeBoxes. Every message is
+    encoded once and queued for each device, and a thread per device sends it, so the
+    devices are served concurrently and a slow or disconnected device cannot stall the
+    others (see GroupMember)."""
+
+    messages = None
+    members = None
+    max_queue = None
+
+    def __init__(self, max_queue=8):
+        self.messages = TimeBoxMessages()
+        self.members = []
+        self.max_queue = max_queue
+
+    def add(self, host=None, port=4, sock=None, name=None):
+        """Connect a TimeBox (see TimeBox.connect) and add it to the group. Returns its
+        GroupMember. The input from the TimeBox is read by its reader thread, so it does not
+        fill up with unread acknowledgements; the messages are available through
+        member.timebox.get_message."""
+        timebox = TimeBox()
+        timebox.connect(host, port, reader=True, sock=sock)
+        if name is None:
+            name = host if host is not None else 'timebox%d' % len(self.members)
+        member = GroupMember(name, timebox, self.max_queue)
+        self.members.append(member)
+        return member
+
+    def close(self):
+        """Stop sending and close the connections to all TimeBoxes."""
+        for member in self.members:
+            member.close()
+        self.members = []
+
+    def send_raw(self, data, replaceable=False):
+        """Queue raw data to be sent to all TimeBoxes. If replaceable is True, the data may
+        be dropped for a device that falls behind (see GroupMember)."""
+        data = bytes(data)
+        now = monotonic()
+        for member in self.members:
+            member.put(data, now, replaceable)
+
+    def send_payload(self, payload):
+        """Queue raw payload to be sent to all TimeBoxes. (Will be escaped, checksumed and
+        messaged between 0x01 and 0x02."""
+        self.send_raw(self.messages.frame_message(payload))
+
+    def send_command(self, command, args=None):
+        """Queue command with optional arguments for all TimeBoxes"""
+        self.send_payload(self.messages.command_payload(command, args))
+
+    def flush(self, timeout=None):
+        """Wait until the queued messages have been sent (or dropped) for all TimeBoxes.
+        Returns False if that took longer than timeout seconds, as it may for a stalled
+        device."""
+        deadline = None if timeout is None else monotonic() + timeout
+        for member in self.members:
+            with member.queue.all_tasks_done:
+                while member.queue.unfinished_tasks:
+                    remaining = None if deadline is None else deadline - monotonic()
+                    if remaining is not None and remaining <= 0.0:
+                        return False
+                    member.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def set_static_image(self, image):
+        """Set the image on all TimeBoxes"""
+        self.send_raw(self.messages.static_image_frame(image), replaceable=True)
+
+    def set_dynamic_images(self, images, frame_delay):
+        """Set the images of an animation on all TimeBoxes. The frames are queued as one
+        message, so a device gets either all of them or none."""
+        frames = bytearray()
+        fnum = 0
+        for img in images:
+            frames += self.messages.dynamic_image_frame(img, fnum, frame_delay)
+            fnum = fnum + 1
+        self.send_raw(frames)
+
+    def show_temperature(self, color=None):
+        """Show temperature on all TimeBoxes in Celsius"""
+        args = [0x01, 0x00]
+        if not color is None:
+            args += color
+        self.send_command("set view", args)
+
+    def show_clock(self, color=None):
+        """Show clock on all TimeBoxes in the color"""
+        args = [0x00, 0x01]
+        if not color is None:
+            args += color
+        self.send_command("set view", args)
+
+    def stats(self):
+        """Return the statistics of all TimeBoxes as a dict of dicts, by name."""
+        return dict((member.name, member.stats()) for member in self.members)
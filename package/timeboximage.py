@@ -1,5 +1,12 @@
 """Module defines the TimeBoxImage class. """
 
+from itertools import chain
+try:
+    import numpy as np
+except ImportError:
+    np = None
+from gamma import gamma_table, gamma_array
+
 
 class TimeBoxImage:
     """ An image to be displayed on the TimeBox """
@@ -10,23 +17,36 @@ class TimeBoxImage:
     gamma_value = None
     gamma_table = None
 
+    # the color values as bytes (see pixel_bytes) and the image list they were taken from;
+    # reset when a pixel is set
+    _pixel_bytes = None
+    _pixel_source = None
+
     def __init__(self, height=11, width=11):
         self.height = height
         self.width = width
         self.image = \
             [[[0 for c in range(3)] for x in range(self.width)] for y in range(self.height)]
 
-    def _gamma_correction(self, k):
-        """ Determine the pixel value (0-15) for pixel with brightness k,
-        0<=k<256, considering gamma."""
+    def pixel_bytes(self):
+        """Return the color values as bytes, row by row, RGB per pixel, for instance as key
+        of the message cache (see TimeBoxMessages.enable_cache). They are kept until a pixel
+        is set with put_pixel or put_pixel_gamma or image is replaced; after changing the
+        lists in image directly, call changed."""
+        if self._pixel_bytes is None or self._pixel_source is not self.image:
+            self._pixel_bytes = bytes(chain.from_iterable(chain.from_iterable(self.image)))
+            self._pixel_source = self.image
+        return self._pixel_bytes
 
-        return int(256.0*pow((k/256.0), 1.0 / self.gamma_value)) >> 4
+    def changed(self):
+        """Drop the color values kept by pixel_bytes, after changing image directly."""
+        self._pixel_bytes = None
 
     def set_gamma(self, new_gamma):
-        """ Change the gamma value. Recompute the table."""
+        """ Change the gamma value. The table is shared by all images with this gamma."""
         if self.gamma_value != new_gamma:
             self.gamma_value = new_gamma
-            self.gamma_table = [self._gamma_correction(k) for k in range(256)]
+            self.gamma_table = gamma_table(new_gamma)
 
     def get_pixel_data(self, xix, yix, cix):
         """ return value of pixel (xix, yix) nd color c (0..2) """
@@ -35,8 +55,91 @@ class TimeBoxImage:
     def put_pixel(self, xix, yix, rval, gval, bval):
         """Set a pixel in the image."""
         self.image[yix][xix] = [rval, gval, bval]
+        self._pixel_bytes = None
 
     def put_pixel_gamma(self, xix, yix, rval, gval, bval):
         """Set a pixel in the image, applying gamma correction.
         Values between 0 and 255."""
         self.image[yix][xix] = [self.gamma_table[v] for v in [rval, gval, bval]]
+        self._pixel_bytes = None
+
+
+class TimeBoxArrayImage(TimeBoxImage):
+    """ An image to be displayed on the TimeBox, stored in a contiguous
+    (height, width, 3) uint8 numpy array. Supports the same pixel interface as
+    TimeBoxImage and adds vectorized bulk operations. """
+
+    gamma_lut = None
+
+    def __init__(self, height=11, width=11):
+        if np is None:
+            raise ImportError('TimeBoxArrayImage requires numpy')
+        self.height = height
+        self.width = width
+        self.image = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+
+    @classmethod
+    def from_array(cls, array, gamma=None):
+        """Create an image from an array-like of shape (height, width, 3). If gamma
+        is given, the values are taken to be 0-255 and are gamma corrected,
+        otherwise they are taken to be 0-15."""
+        array = np.asarray(array)
+        if array.ndim != 3 or array.shape[2] != 3:
+            raise ValueError('Expected an array of shape (height, width, 3)')
+        imag = cls(array.shape[0], array.shape[1])
+        imag.image[...] = array
+        if gamma is not None:
+            imag.set_gamma(gamma)
+            imag.apply_gamma()
+        return imag
+
+    def set_gamma(self, new_gamma):
+        """ Change the gamma value. The tables are shared by all images with this gamma."""
+        if self.gamma_value != new_gamma:
+            TimeBoxImage.set_gamma(self, new_gamma)
+            self.gamma_lut = gamma_array(new_gamma)
+
+    def pixel_bytes(self):
+        """Return the color values as bytes, row by row, RGB per pixel. Taken from the
+        array every time, as it is changed in place."""
+        return self.image.tobytes()
+
+    def get_pixel_data(self, xix, yix, cix):
+        """ return value of pixel (xix, yix) nd color c (0..2) """
+        return self.image.item(yix, xix, cix)
+
+    def put_pixel(self, xix, yix, rval, gval, bval):
+        """Set a pixel in the image."""
+        self.image[yix, xix] = (rval, gval, bval)
+
+    def put_pixel_gamma(self, xix, yix, rval, gval, bval):
+        """Set a pixel in the image, applying gamma correction.
+        Values between 0 and 255."""
+        self.image[yix, xix] = \
+            (self.gamma_table[rval], self.gamma_table[gval], self.gamma_table[bval])
+
+    def fill(self, rval, gval, bval):
+        """Set all pixels of the image to the same color."""
+        self.image[...] = (rval, gval, bval)
+
+    def blit(self, src, xix=0, yix=0):
+        """Copy an image or (height, width, 3) array into this image with its top left
+        corner at (xix, yix). Parts falling outside the image are clipped."""
+        if isinstance(src, TimeBoxImage):
+            src = src.image
+        src = np.asarray(src)
+        src_x0, src_y0 = max(0, -xix), max(0, -yix)
+        dst_x0, dst_y0 = max(0, xix), max(0, yix)
+        dst_x1 = min(self.width, xix + src.shape[1])
+        dst_y1 = min(self.height, yix + src.shape[0])
+        if dst_x1 <= dst_x0 or dst_y1 <= dst_y0:
+            return
+        self.image[dst_y0:dst_y1, dst_x0:dst_x1] = \
+            src[src_y0:src_y0 + dst_y1 - dst_y0, src_x0:src_x0 + dst_x1 - dst_x0]
+
+    def apply_gamma(self):
+        """Gamma correct the whole image in place, mapping values 0-255 to 0-15.
+        The gamma must have been set with set_gamma."""
+        if self.gamma_lut is None:
+            raise ValueError('No gamma value set')
+        np.take(self.gamma_lut, self.image, out=self.image)
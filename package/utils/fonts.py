@@ -1,34 +1,129 @@
 """ Sprite based fonts upport """
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
 from utils.gifreader import GIFReader
+from gamma import gamma_table
 
 class Fonts:
-    """ Manages a simpe sprite based font."""
+    """ Manages a simpe sprite based font. The gamma corrected pixels of the 26 characters
+    are kept in an atlas. If a cache_dir is given, the atlas is cached in a file there, so
+    later runs map the file instead of decoding the sprite GIF."""
+    ATLAS_MAGIC = b'TBFA'
+    ATLAS_VERSION = 1
+    # magic, version, font height, font width, number of characters
+    ATLAS_HEADER = struct.Struct('<4sHHHH')
+    CHARACTERS = 26
+
     gamma_value = None
     gamma_table = None
     gif_reader = None
+    font_sprite_file = None
     font_height = None
     font_spacing = None
+    cache_dir = None
+    atlas = None
 
-    def __init__(self, font_sprite_file, font_height, font_width, font_spacing, gamma=1.0):
-        """Initialize as reader on dat"""
-        self.set_gamma(gamma)
+    def __init__(self, font_sprite_file, font_height, font_width, font_spacing, gamma=1.0,
+                 cache_dir=None):
+        """Initialize as reader on dat. The atlas is cached in the directory cache_dir, for
+        instance Fonts.default_cache_dir(); with None (the default) nothing is written."""
         self.font_height = font_height
         self.font_width = font_width
         self.font_spacing = font_spacing
-        self.gif_reader = GIFReader()
-        self.gif_reader.read(font_sprite_file)
+        self.font_sprite_file = font_sprite_file
+        self.cache_dir = cache_dir
+        self.set_gamma(gamma)
 
+    @staticmethod
+    def default_cache_dir():
+        """The per user cache directory of font atlases: timebox/fonts in $XDG_CACHE_HOME,
+        or in ~/.cache if that is not set."""
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'),
+                                                                '.cache')
+        return os.path.join(base, 'timebox', 'fonts')
 
     def set_gamma(self, new_gamma):
-        """ Change the gamma value. Reocomputa the table."""
+        """ Change the gamma value. Reocomputa the atlas."""
         self.gamma_value = new_gamma
-        self.gamma_table = dict()
-        for k in range(256):
-            self.gamma_table[k] = self._pixelvalue(k)
+        # the sprite is mapped with scale 255 rather than the 256 of the images
+        self.gamma_table = gamma_table(new_gamma, 255.0)
+        if self.font_sprite_file is not None:
+            self._load_atlas()
+
+    def _cache_file(self):
+        """The name of the cache file of the atlas, determined by the content of the
+        sprite file, the font dimensions and the gamma value."""
+        with open(self.font_sprite_file, 'rb') as file:
+            digest = hashlib.sha1(file.read())
+        # gamma None (no gamma correction) must not map to the key of a gamma value
+        gamma = None if self.gamma_value is None else float(self.gamma_value)
+        digest.update(repr((self.font_height, self.font_width, self.font_spacing,
+                            gamma)).encode())
+        return os.path.join(self.cache_dir, digest.hexdigest() + '.atlas')
+
+    def _load_atlas(self):
+        """Map the atlas from the cache file, or create it from the sprite GIF (and store
+        it in the cache)."""
+        cache_file = None
+        if self.cache_dir is not None:
+            cache_file = self._cache_file()
+            atlas = self._map_atlas(cache_file)
+            if atlas is not None:
+                self.atlas = atlas
+                return
+        self.atlas = self._make_atlas()
+        if cache_file is not None:
+            self._write_atlas(cache_file)
+
+    def _map_atlas(self, cache_file):
+        """Return the atlas in cache_file as memoryview, or None if the file is missing
+        or does not fit the font."""
+        try:
+            with open(cache_file, 'rb') as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        header = (self.ATLAS_MAGIC, self.ATLAS_VERSION, self.font_height, self.font_width,
+                  self.CHARACTERS)
+        size = self.ATLAS_HEADER.size + \
+            3 * self.CHARACTERS * self.font_height * self.font_width
+        if len(mapped) != size or \
+                self.ATLAS_HEADER.unpack_from(mapped) != header:
+            mapped.close()
+            return None
+        return memoryview(mapped)[self.ATLAS_HEADER.size:]
 
-    def _pixelvalue(self, k):
-        """ Determine the pixel value for pixel with brightness k, 0<=k<256, considering gamma."""
-        return int(255.0*pow((k/256.0), 1.0 / self.gamma_value)) >> 4
+    def _write_atlas(self, cache_file):
+        """Store the atlas in cache_file. Failing to write the cache is not an error."""
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd, 'wb') as file:
+                file.write(self.ATLAS_HEADER.pack(self.ATLAS_MAGIC, self.ATLAS_VERSION,
+                                                  self.font_height, self.font_width,
+                                                  self.CHARACTERS))
+                file.write(self.atlas)
+            os.replace(tmp_name, cache_file)
+        except OSError:
+            pass
+
+    def _make_atlas(self):
+        """Decode the sprite GIF and return the gamma corrected pixels of the characters,
+        character by character, row by row, RGB per pixel."""
+        if self.gif_reader is None:
+            self.gif_reader = GIFReader()
+            self.gif_reader.read(self.font_sprite_file)
+        atlas = bytearray()
+        for charnum in range(self.CHARACTERS):
+            for yix in range(self.font_height):
+                for xix in range(self.font_width):
+                    atlas += bytes(self.gif_reader.get_pixel(xix + charnum * self.font_spacing,
+                                                             yix))
+        return bytes(atlas).translate(self.gamma_table)
 
     def get_pixel(self, char, xix, yix):
         """Get pixel from char with coordinates (xix, yix)."""
@@ -37,6 +132,55 @@ class Fonts:
             raise Exception("Illegal character")
         if not (xix in range(0, self.font_width) and yix in range(0, self.font_height)):
             raise Exception("Illegal coordinates")
-        glob_xix = xix + charnum * self.font_spacing
-        color = self.gif_reader.output_image[glob_xix][yix]
-        return [self.gamma_table[color[0]], self.gamma_table[color[1]], self.gamma_table[color[2]]]
+        off = 3 * ((charnum * self.font_height + yix) * self.font_width + xix)
+        return list(self.atlas[off:off+3])
+
+
+class TextRenderer:
+    """ Renders a text once into a wide strip of gamma corrected pixels, from which the
+    images of scrolling text are cut. The images are bytes with the color values (0-15) row
+    by row, RGB per pixel, as accepted by TimeBox.set_static_image."""
+    font = None
+    text = None
+    spacing = None
+    width = 11
+    height = 11
+    text_width = None
+    rows = None
+
+    def __init__(self, font, text, spacing=2, top=1, width=11, height=11):
+        """Render text with font, with spacing blank columns after each character, starting
+        at row top of images of width x height pixels. Spaces are rendered as blank
+        characters."""
+        self.font = font
+        self.text = text
+        self.spacing = spacing
+        self.width = width
+        self.height = height
+        char_width = font.font_width + spacing
+        self.text_width = len(text) * char_width
+        # the strip has a blank display width on either side of the text
+        strip_width = self.text_width + 2 * width
+        self.rows = [bytearray(3 * strip_width) for _ in range(height)]
+        for charnum, char in enumerate(text):
+            if char == ' ':
+                continue
+            for xix in range(font.font_width):
+                sxix = 3 * (width + charnum * char_width + xix)
+                for yix in range(font.font_height):
+                    if 0 <= top + yix < height:
+                        self.rows[top + yix][sxix:sxix+3] = font.get_pixel(char, xix, yix)
+        self.rows = [bytes(row) for row in self.rows]
+
+    def window(self, offset):
+        """Return the image showing the text from column offset on (negative offsets shift
+        the text to the right). offset ranges from -width to text_width."""
+        start = 3 * (offset + self.width)
+        end = start + 3 * self.width
+        return b''.join([row[start:end] for row in self.rows])
+
+    def frames(self):
+        """Generate the images of a marquee, the text scrolling from right to left by one
+        column per image, starting and ending with a blank display."""
+        for offset in range(-self.width, self.text_width + 1):
+            yield self.window(offset)
@@ -2,90 +2,78 @@
 Handling the reading of GIF images and transforming them to TimeBox images.
 Based on http://www.matthewflickinger.com/lab/whatsinagif/bits_and_bytes.asp """
 
-CLEARCODEVAL = -1
-EOICODEVAL = -2
+import sys
+import mmap
+from timeboximage import TimeBoxImage
+
+MAXCODES = 4096
 
 class CodeTable:
-    """ Implements the code table for LZW decompression."""
+    """ Implements the code table for LZW decompression. The code words are kept in a list
+    indexed by code, each as bytes with its string of color indices. A new code word is
+    its prefix code word plus one index, and the next free code is tracked in a counter,
+    so adding a code word takes time proportional to its length only."""
 
     code_table = None
+    clear_code = None
+    eoi_code = None
+    next_code = None
 
     def __init__(self, lzw_min_code_sz, col_table_sz):
         """Initialize the table, depending on the specified lzw min code size
         and color table size."""
-        self.code_table = dict()
-        clear_code = 1<<lzw_min_code_sz
-        eoi_code = clear_code + 1
-        self.code_table[clear_code] = [CLEARCODEVAL]
-        self.code_table[eoi_code] = [EOICODEVAL]
-        for color in range(col_table_sz):
-            self.code_table[color] = [color]
-
-    def has_key_with_value(self, key, value):
-        """Returns True if key exists and has the value. Otherwise it returns False."""
-        if not key in self.code_table:
-            return False
-        if self.code_table[key] != value:
-            return False
-        return True
+        self.clear_code = 1<<lzw_min_code_sz
+        self.eoi_code = self.clear_code + 1
+        self.code_table = [None] * MAXCODES
+        for color in range(max(col_table_sz, self.clear_code)):
+            self.code_table[color] = bytes([color & 0xff])
+        self.next_code = self.eoi_code + 1
+
+    def reset(self):
+        """Remove all code words added since initialization (after a clear code)."""
+        self.next_code = self.eoi_code + 1
 
     def has_key(self, key):
         """Returns True if key exists. Otherwise it returns False."""
-        return key in self.code_table
-
+        return key < self.next_code and key != self.clear_code and key != self.eoi_code
 
     def get(self, key):
-        """Get the value for a key"""
+        """Get the string of color indices (bytes) for a key"""
         return self.code_table[key]
 
-    def at_put(self, key, value):
-        """Store a new value in the table for key"""
-        self.code_table[key] = value
-
-    def at_new_key_put(self, value):
-        """Store a new value in the table for a new key. Returns the new key."""
-        key = self.new_key()
-        self.code_table[key] = value
+    def add(self, prefix, idx_k):
+        """Add a new code word: the string prefix (bytes) followed by index idx_k. Returns
+        the new key, or None if the table is full."""
+        if self.next_code >= MAXCODES:
+            return None
+        key = self.next_code
+        self.code_table[key] = prefix + bytes([idx_k])
+        self.next_code = key + 1
         return key
 
-    def new_key(self):
-        """Return the smallest unused key value"""
-        return max(self.code_table.keys()) + 1
-
 
 class CodeReader:
     """Read bit information from data block."""
 
-    data = 0
+    data = None
     data_byte_idx = 0
-    data_bit_idx = 0
+    # bits read from the data, but not yet returned as code
+    bit_buffer = 0
+    bit_count = 0
 
     def __init__(self, dat):
         """Initialize as reader on dat"""
         self.data = dat
 
     def read(self, bits_per_code_word):
-        """Read a new code word from the stream. Returns code, new data
-        byte index, and new data bit index  """
-        remaining_bits = bits_per_code_word
-        acquired_bits = 0
-        res = 0
-        # while we need the remainder of the current byte
-        while remaining_bits >= 8 -self.data_bit_idx:
-            val = self.data[self.data_byte_idx] >> self.data_bit_idx
-            res = res + (val << acquired_bits)
-            remaining_bits = remaining_bits - (8 - self.data_bit_idx)
-            acquired_bits = acquired_bits + (8 - self.data_bit_idx)
-            self.data_byte_idx = self.data_byte_idx + 1
-            self.data_bit_idx = 0
-
-        # less than 8 (possibly 0) bits remain from last byte
-        if remaining_bits > 0:
-            val = self.data[self.data_byte_idx] & ((1<<remaining_bits)-1)
-            res = res + (val << acquired_bits)
-            acquired_bits = acquired_bits + remaining_bits
-            self.data_bit_idx = remaining_bits
-            remaining_bits = 0
+        """Read a new code word from the stream, least significant bits first."""
+        while self.bit_count < bits_per_code_word:
+            self.bit_buffer |= self.data[self.data_byte_idx] << self.bit_count
+            self.data_byte_idx += 1
+            self.bit_count += 8
+        res = self.bit_buffer & ((1 << bits_per_code_word) - 1)
+        self.bit_buffer >>= bits_per_code_word
+        self.bit_count -= bits_per_code_word
         return res
 
 class GIFReader:
@@ -106,74 +94,97 @@ class GIFReader:
     pix_asp_ratio = None
 
     color_table = None
+    glob_palette = None
+
+    # graphic control of the next image
+    frame_delay = None
+    frame_disposal = None
+    frame_transparent = None
 
     data_idx = None
 
-    output_image = None
+    # the decoded image of read(): color indices into palette, row by row, or, if the
+    # images use different color tables, RGB bytes in canvas_rgb
+    canvas = None
+    palette = None
+    canvas_rgb = None
+    _output_image = None
 
     def decode_subblock(self, data):
-        """Decode data from the subblock."""
+        """Decode the LZW compressed image data. Returns a bytearray with the color indices."""
+        return next(self._decode_chunks(data))
+
+    def _decode_chunks(self, data, chunk_size=None):
+        """Decode the LZW compressed image data. Yields the color indices as bytearrays of
+        at least chunk_size bytes (the last one may be shorter) as they are decoded, or all
+        in one bytearray if chunk_size is None."""
+        if chunk_size is None:
+            chunk_size = sys.maxsize
         code_reader = CodeReader(data)
+        read = code_reader.read
         # initialize output stream
-        output = list()
+        output = bytearray()
         # Initialize code table
         code_table = CodeTable(self.lzw_min_code_sz, self.glob_col_table_sz)
+        clear_code = code_table.clear_code
+        eoi_code = code_table.eoi_code
 
         bits_per_code_word = self.lzw_min_code_sz + 1
         #let CODE be the first code in the code stream
-        code = code_reader.read(bits_per_code_word)
-
-        if not code_table.has_key_with_value(code, [CLEARCODEVAL]):
+        if read(bits_per_code_word) != clear_code:
             raise Exception('Expected Clear Code.')
 
-        # wile we have hit a reinitialization of the code table, but no end of information yet
-        while code_table.has_key_with_value(code, [CLEARCODEVAL]) and \
-                not code_table.has_key_with_value(code, [EOICODEVAL]):
-
-            # read next actual code
-            code = code_reader.read(bits_per_code_word)
-
-            #output {CODE} to index stream
-            output.extend(code_table.get(code))
-
-            # until the End of Information code word is hit...
-            while not code_table.has_key_with_value(code, [EOICODEVAL]):
-                # remember previous code
-                prev_code = code
-                #let CODE be the next code in the code stream
-                code = code_reader.read(bits_per_code_word)
-                # check if table needs to re-initialized
-                if code_table.has_key_with_value(code, [CLEARCODEVAL]):
-                    # Initialize code table
-                    code_table = CodeTable(self.lzw_min_code_sz, self.glob_col_table_sz)
-                    break
-
-                if code_table.has_key_with_value(code, [EOICODEVAL]):
-                    break
-
-                #is CODE in the code table?
-                if code_table.has_key(code):
-                    #output {CODE} to index stream
-                    output.extend(code_table.get(code))
-                    #let K be the first index in {CODE}
-                    idx_k = code_table.get(code)[0]
-                else:
-                    #let K be the first index of {CODE-1}
-                    idx_k = code_table.get(prev_code)[0]
-                    #output {CODE-1}+K to index stream
-                    output.extend(code_table.get(prev_code) + [idx_k])
-                #add {CODE-1}+K to code table
-                new_code_word = code_table.get(prev_code) + [idx_k]
-                if code_table.at_new_key_put(new_code_word) == (1 << bits_per_code_word) - 1:
-                    # reached the range of code words, need to extend the code lengh
-                    bits_per_code_word += 1
-        return output
+        # code word of the previous code, None directly after a clear code
+        prev = None
+        while True:
+            code = read(bits_per_code_word)
+            if code == clear_code:
+                # re-initialize the code table
+                code_table.reset()
+                bits_per_code_word = self.lzw_min_code_sz + 1
+                prev = None
+                continue
+            if code == eoi_code:
+                break
+
+            if prev is None:
+                # first code after a clear code, it is always in the table
+                word = code_table.get(code)
+            elif code < code_table.next_code:
+                #output {CODE} to index stream and add {CODE-1}+K, K first index of {CODE}
+                word = code_table.get(code)
+                new_code = code_table.add(prev, word[0])
+            else:
+                #output {CODE-1}+K, K the first index of {CODE-1}, and add it to the table
+                word = prev + prev[:1]
+                new_code = code_table.add(prev, prev[0])
+            output += word
+            if len(output) >= chunk_size:
+                yield output
+                output = bytearray()
+
+            if prev is not None and new_code == (1 << bits_per_code_word) - 1 and \
+                    bits_per_code_word < 12:
+                # reached the range of code words, need to extend the code lengh
+                bits_per_code_word += 1
+            prev = word
+        yield output
 
 
     def _get_file_content(self):
-        """Get the file content"""
+        """Get the file content, memory mapped."""
         with open(self.file_name, mode='rb') as file:
-            self.file_content = file.read()
+            try:
+                self.file_content = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # an empty file cannot be mapped
+                self.file_content = file.read()
+
+    def _close_file_content(self):
+        """Release the file content."""
+        if isinstance(self.file_content, mmap.mmap):
+            self.file_content.close()
+        self.file_content = None
 
     def _decode_header(self):
         """Decodes the GIF header."""
@@ -208,83 +219,400 @@ class GIFReader:
             self.color_table[colnum][1] = color_table_bytes[3*colnum+1]
             self.color_table[colnum][2] = color_table_bytes[3*colnum+2]
 
+    def _read_sub_blocks(self):
+        """Read a chain of data sub-blocks, up to and including the terminator.
+        Returns the data as a bytearray."""
+        data = bytearray()
+        while self.file_content[self.data_idx] != 0:
+            subblock_sz = self.file_content[self.data_idx]
+            self.data_idx = self.data_idx + 1
+            data += self.file_content[self.data_idx:self.data_idx + subblock_sz]
+            self.data_idx = self.data_idx + subblock_sz
+        self.data_idx = self.data_idx + 1
+        return data
+
     def _handle_extensions_blocks(self):
-        """Handle the extension blocks. (For now just sip them.)"""
+        """Handle the extension blocks. The graphic control extension sets the delay,
+        disposal method and transparent color of the next image, others are skipped."""
         # extension blocks
         while self.file_content[self.data_idx] == 0x21:
-            block_size = self.file_content[self.data_idx + 2]
-            # ext = self.file_content[self.data_idx:self.data_idx + block_size + 4]
-            self.data_idx = self.data_idx + block_size + 4
-
+            label = self.file_content[self.data_idx + 1]
+            self.data_idx = self.data_idx + 2
+            data = self._read_sub_blocks()
+            if label == 0xf9 and len(data) >= 4:
+                self.frame_disposal = (data[0] & 0b00011100) >> 2
+                self.frame_delay = data[1] + (data[2] << 8)
+                self.frame_transparent = data[3] if (data[0] & 0b00000001) != 0 else None
+
+    def _read_image(self):
+        """Read an image descriptor with its image data. Returns the position and size
+        of the image, its color table as bytes with RGB triplets, and its color indices
+        as a bytearray, row by row."""
+        img_left, img_top, img_width, img_height, palette, interlace_flag = \
+            self._read_image_descriptor()
+        indices = self.decode_subblock(self._read_sub_blocks())
+        # pad missing data, and drop superfluous data
+        size = img_width * img_height
+        indices = indices[:size] + bytes(max(0, size - len(indices)))
+        if interlace_flag:
+            indices = self._deinterlace(indices, img_width, img_height)
+        return img_left, img_top, img_width, img_height, palette, indices
+
+    def _read_image_descriptor(self):
+        """Read an image descriptor and its local color table, up to the LZW minimum code
+        size. Returns the position and size of the image, its color table as bytes with
+        RGB triplets and whether it is interlaced."""
+        img_left = self.file_content[self.data_idx + 1] + \
+            (self.file_content[self.data_idx + 2] << 8)
+        img_top = self.file_content[self.data_idx + 3] + \
+            (self.file_content[self.data_idx + 4] << 8)
+        img_width = self.file_content[self.data_idx+5] + \
+            (self.file_content[self.data_idx + 6] << 8)
+        img_height = self.file_content[self.data_idx+7] + \
+            (self.file_content[self.data_idx + 8] << 8)
+        flags = self.file_content[self.data_idx + 9]
+        local_col_table_flag = (flags & 0b10000000) != 0
+        interlace_flag = (flags & 0b01000000) != 0
+        self.data_idx = self.data_idx + 10
+        palette = self.glob_palette
+        if local_col_table_flag:
+            local_col_table_sz = 1 << ((flags & 0b00000111)+1)
+            palette = self.file_content[self.data_idx:self.data_idx + 3*local_col_table_sz]
+            self.data_idx = self.data_idx + 3*local_col_table_sz
+
+        self.lzw_min_code_sz = self.file_content[self.data_idx]
+        self.data_idx = self.data_idx + 1
+        return img_left, img_top, img_width, img_height, palette, interlace_flag
+
+    def _row_order(self, height, interlaced):
+        """Return the numbers of the rows of an image in the order they are stored."""
+        if not interlaced:
+            return range(height)
+        return [yix for start, step in ((0, 8), (4, 8), (2, 4), (1, 2))
+                for yix in range(start, height, step)]
+
+    def _deinterlace(self, indices, width, height):
+        """Put the rows of an interlaced image in order."""
+        rows = [None] * height
+        for rix, yix in enumerate(self._row_order(height, True)):
+            rows[yix] = indices[rix*width:(rix+1)*width]
+        return bytearray().join(rows)
 
     def _handle_image_descriptors(self):
         """Handle the image descrriptors with image data"""
         while self.file_content[self.data_idx] == 0x2c:
-            img_left = self.file_content[self.data_idx + 1] + \
-                (self.file_content[self.data_idx + 2] << 8)
-            img_top = self.file_content[self.data_idx + 3] + \
-                (self.file_content[self.data_idx + 4] << 8)
-            img_width = self.file_content[self.data_idx+5] + \
-                (self.file_content[self.data_idx + 6] << 8)
-            #img_height = self.file_content[self.data_idx+7] + \
-            #    (self.file_content[self.data_idx + 8] << 8)
-            flags = self.file_content[self.data_idx + 9]
-            local_col_table_flag = (flags & 0b10000000) != 0
-            #interlace_flag = (flags & 0b01000000) != 0
-            self.data_idx = self.data_idx + 10
-            if local_col_table_flag:
-                # read local color table
-                print('read local color table. Not implemented yet')
-
-            self.lzw_min_code_sz = self.file_content[self.data_idx]
-            self.data_idx = self.data_idx + 1
-
-            pix_xix = img_left
-            pix_yix = img_top
-            subblock_data = []
-            while self.file_content[self.data_idx] != 0:
-                subblock_sz = self.file_content[self.data_idx]
-                self.data_idx = self.data_idx + 1
-                subblock_data += self.file_content[self.data_idx:self.data_idx + subblock_sz]
-                self.data_idx = self.data_idx + subblock_sz
-            self.data_idx = self.data_idx + 1
-            dec_data = self.decode_subblock(subblock_data)
-            for dat in dec_data:
-                self.output_image[pix_xix][pix_yix][0] = self.color_table[dat][0]
-                self.output_image[pix_xix][pix_yix][1] = self.color_table[dat][1]
-                self.output_image[pix_xix][pix_yix][2] = self.color_table[dat][2]
-                pix_xix = pix_xix + 1
-                if pix_xix == img_left + img_width:
-                    pix_xix = img_left
-                    pix_yix = pix_yix + 1
-
-
-
-    def read(self, fname):
-        """Read and decode the specified GIF file."""
-        # decoding following the description at:
-        # http://www.matthewflickinger.com/lab/whatsinagif/bits_and_bytes.asp
-
+            img_left, img_top, img_width, img_height, palette, indices = self._read_image()
+            # the part of the image that lies on the canvas
+            right = min(img_left + img_width, self.canvas_width)
+            bottom = min(img_top + img_height, self.canvas_height)
+            if self.canvas_rgb is None and palette != self.palette:
+                if img_left == 0 and img_top == 0 and right == self.canvas_width and \
+                        bottom == self.canvas_height:
+                    # the image replaces the whole canvas, and with it the colors
+                    self.palette = palette
+                else:
+                    # the indices of the canvas and the image refer to different colors
+                    self.canvas_rgb = bytearray(self.get_rgb())
+            if self.canvas_rgb is not None:
+                self._draw(self.canvas_rgb, img_left, img_top, img_width, right, bottom,
+                           palette, indices, None)
+                continue
+            for yix in range(img_top, bottom):
+                off = (yix - img_top) * img_width
+                self.canvas[yix*self.canvas_width+img_left:yix*self.canvas_width+right] = \
+                    indices[off:off + right - img_left]
+
+    def _start(self, fname):
+        """Open the file and read the header and global color table."""
         self.file_name = fname
 
         self._get_file_content()
 
         self._decode_header()
 
-        # create output image
-        self.output_image = [[[0 for c in range(3)] \
-            for y in range(self.canvas_height)] \
-            for x in range(self.canvas_width)]
-
         # the global color table will take up 3*2^(N+1) bytes in the stream.
-        self.data_idx = 13+3*self.glob_col_table_sz
+        if self.glob_col_table:
+            self.data_idx = 13+3*self.glob_col_table_sz
+        else:
+            self.data_idx = 13
+        self.glob_palette = bytes(self.file_content[13:self.data_idx]) + bytes(3*256)
 
-        color_table_bytes = self.file_content[13:self.data_idx]
+        color_table_bytes = self.glob_palette
         self._read_color_table(color_table_bytes)
 
-        self._handle_extensions_blocks()
+        self.frame_delay = 0
+        self.frame_disposal = 0
+        self.frame_transparent = None
 
-        self._handle_image_descriptors()
+    def read(self, fname):
+        """Read and decode the specified GIF file."""
+        # decoding following the description at:
+        # http://www.matthewflickinger.com/lab/whatsinagif/bits_and_bytes.asp
 
-        if self.file_content[self.data_idx] != 0x3b:
-            raise Exception('Decoding of the GIF failed')
+        self._start(fname)
+        try:
+            # create output image, filled with the background color
+            self.canvas = bytearray([self.bg_color_index]) * \
+                (self.canvas_width * self.canvas_height)
+            self.palette = self.glob_palette
+            self.canvas_rgb = None
+            self._output_image = None
+
+            # extensions may precede every image (e.g. the graphic control of a frame)
+            while self.file_content[self.data_idx] in (0x21, 0x2c):
+                self._handle_extensions_blocks()
+                self._handle_image_descriptors()
+
+            if self.file_content[self.data_idx] != 0x3b:
+                raise Exception('Decoding of the GIF failed')
+        finally:
+            self._close_file_content()
+
+    def get_pixel(self, xix, yix):
+        """Return the color of pixel (xix, yix) of the image decoded by read() as list of
+        R, G and B."""
+        if self.canvas_rgb is not None:
+            off = 3 * (yix * self.canvas_width + xix)
+            return list(self.canvas_rgb[off:off+3])
+        off = 3 * self.canvas[yix * self.canvas_width + xix]
+        return list(self.palette[off:off+3])
+
+    def get_rgb(self):
+        """Return the image decoded by read() as bytes with RGB triplets, row by row."""
+        if self.canvas_rgb is not None:
+            return bytes(self.canvas_rgb)
+        return bytes(self._indices_to_rgb(self.canvas, self.palette))
+
+    @property
+    def output_image(self):
+        """The image decoded by read() as nested lists, indexed [x][y][color]. It is only
+        created when used, prefer get_pixel or get_rgb."""
+        if self._output_image is None and self.canvas is not None:
+            rgb = self.get_rgb()
+            row_sz = 3 * self.canvas_width
+            self._output_image = [[list(rgb[yix*row_sz+3*xix:yix*row_sz+3*xix+3]) \
+                for yix in range(self.canvas_height)] \
+                for xix in range(self.canvas_width)]
+        return self._output_image
+
+    def read_scaled(self, fname, width=11, height=11, gamma=None):
+        """Read the first image of the specified GIF file and scale it to width x height
+        pixels with a box filter: each target pixel is the average of the source pixels it
+        covers, weighted by the covered area. The rows are accumulated as the LZW decoder
+        produces them, so neither the canvas nor the color indices of the whole image are
+        kept. Pixels outside the image and transparent pixels get the background color.
+        Returns a TimeBoxImage, gamma corrected if gamma is given."""
+        self._start(fname)
+        try:
+            self._handle_extensions_blocks()
+            if self.file_content[self.data_idx] != 0x2c:
+                raise Exception('Decoding of the GIF failed')
+            img_left, img_top, img_width, img_height, palette, interlaced = \
+                self._read_image_descriptor()
+            data = self._read_sub_blocks()
+        finally:
+            self._close_file_content()
+
+        # a translation table from color index to value for each color channel
+        channels = [bytearray(bytes(palette[cix::3][:256]).ljust(256, b'\x00'))
+                    for cix in range(3)]
+        if self.frame_transparent is not None:
+            for cix in range(3):
+                channels[cix][self.frame_transparent] = \
+                    self.glob_palette[3*self.bg_color_index+cix]
+        background = bytearray([self.bg_color_index]) * self.canvas_width
+        if self.frame_transparent is not None:
+            background = bytearray([self.frame_transparent]) * self.canvas_width
+
+        # sums of the color values of the target pixels, weighted by the covered area in
+        # units of 1 / (width * height) source pixels
+        sums = [0] * (3 * width * height)
+        columns = self._box_weights(self.canvas_width, width)
+        for yix in list(range(min(img_top, self.canvas_height))) + \
+                list(range(img_top + img_height, self.canvas_height)):
+            self._add_scaled_row(sums, yix, background, channels, columns, width, height)
+        rows = iter(self._row_order(img_height, interlaced))
+        pending = bytearray()
+        for chunk in self._decode_chunks(data, img_width):
+            pending += chunk
+            while len(pending) >= img_width:
+                self._add_image_row(sums, next(rows, None), pending[:img_width], background,
+                                    img_left, img_top, channels, columns, width, height)
+                del pending[:img_width]
+        # pad missing data
+        pending += bytes(img_width - len(pending))
+        for rix in rows:
+            self._add_image_row(sums, rix, pending, background, img_left, img_top,
+                                channels, columns, width, height)
+            pending = bytes(img_width)
+
+        area = self.canvas_width * self.canvas_height
+        image = TimeBoxImage(height, width)
+        if gamma is not None:
+            image.set_gamma(gamma)
+        for tyix in range(height):
+            for txix in range(width):
+                off = 3 * (tyix * width + txix)
+                rgb = [(val + area // 2) // area for val in sums[off:off + 3]]
+                if gamma is not None:
+                    image.put_pixel_gamma(txix, tyix, rgb[0], rgb[1], rgb[2])
+                else:
+                    image.put_pixel(txix, tyix, rgb[0] >> 4, rgb[1] >> 4, rgb[2] >> 4)
+        return image
+
+    def _box_weights(self, size, target_size):
+        """Return for each of target_size target pixels the source pixels (out of size) it
+        covers as tuple (first, last, weight of first, weight of last), the weights being
+        the covered lengths in units of 1 / target_size source pixels. The source pixels
+        between first and last are covered completely."""
+        weights = []
+        for tix in range(target_size):
+            start, end = tix * size, (tix + 1) * size
+            first, last = start // target_size, (end - 1) // target_size
+            if first == last:
+                weights.append((first, last, size, 0))
+            else:
+                weights.append((first, last, (first + 1) * target_size - start,
+                                end - last * target_size))
+        return weights
+
+    def _add_image_row(self, sums, rix, row, background, img_left, img_top, channels,
+                       columns, width, height):
+        """Add row rix of the image (color indices), placed on background, to sums. Rows
+        beyond the image or the canvas (rix None or too large) are superfluous data."""
+        if rix is None or img_top + rix >= self.canvas_height:
+            return
+        if img_left != 0 or len(row) != self.canvas_width:
+            row = (background[:img_left] + row +
+                   background[img_left + len(row):])[:self.canvas_width]
+        self._add_scaled_row(sums, img_top + rix, row, channels, columns, width, height)
+
+    def _add_scaled_row(self, sums, yix, row, channels, columns, width, height):
+        """Add canvas row yix (color indices) to the sums of the target rows it covers,
+        weighted by the covered areas."""
+        first_row, last_row = yix * height // self.canvas_height, \
+            ((yix + 1) * height - 1) // self.canvas_height
+        for cix in range(3):
+            values = row.translate(channels[cix])
+            for txix, (first, last, first_weight, last_weight) in enumerate(columns):
+                col_sum = first_weight * values[first]
+                if last > first:
+                    col_sum += last_weight * values[last] + \
+                        width * sum(values[first + 1:last])
+                for tyix in range(first_row, last_row + 1):
+                    # the part of the row that lies in target row tyix
+                    weight = min((yix + 1) * height, (tyix + 1) * self.canvas_height) - \
+                        max(yix * height, tyix * self.canvas_height)
+                    sums[3 * (tyix * width + txix) + cix] += weight * col_sum
+
+    def iter_frames(self, fname):
+        """Decode the specified GIF file frame by frame. Yields a GIFFrame for every image
+        in the file, with the canvas as it is displayed at that point of the animation,
+        honoring transparency, disposal methods and local color tables. The frames share a
+        single canvas, which is updated when the iteration continues."""
+        self._start(fname)
+        try:
+            for frame in self._iter_frames():
+                yield frame
+        finally:
+            self._close_file_content()
+
+    def _iter_frames(self):
+        """Yield the frames of the opened file, see iter_frames."""
+        width, height = self.canvas_width, self.canvas_height
+        # the canvas is cleared to the background color; black if that is transparent
+        background = self.glob_palette[3*self.bg_color_index:3*self.bg_color_index+3]
+        canvas = bytearray(background * (width * height))
+
+        frame_num = 0
+        while True:
+            block = self.file_content[self.data_idx]
+            if block == 0x21:
+                self._handle_extensions_blocks()
+            elif block == 0x2c:
+                img_left, img_top, img_width, img_height, palette, indices = self._read_image()
+                # the part of the image that lies on the canvas
+                right = min(img_left + img_width, width)
+                bottom = min(img_top + img_height, height)
+                saved = None
+                if self.frame_disposal == 3:
+                    saved = [canvas[3*(yix*width+img_left):3*(yix*width+right)]
+                             for yix in range(img_top, bottom)]
+                self._draw(canvas, img_left, img_top, img_width, right, bottom, palette,
+                           indices, self.frame_transparent)
+                yield GIFFrame(frame_num, width, height, canvas, self.frame_delay,
+                               self.frame_disposal)
+                frame_num = frame_num + 1
+
+                # dispose of the image before the next one is drawn
+                if self.frame_disposal == 2:
+                    fill = background if self.frame_transparent is None else bytes(3)
+                    for yix in range(img_top, bottom):
+                        canvas[3*(yix*width+img_left):3*(yix*width+right)] = \
+                            fill * (right - img_left)
+                elif saved is not None:
+                    for yix in range(img_top, bottom):
+                        canvas[3*(yix*width+img_left):3*(yix*width+right)] = saved[yix-img_top]
+                # the graphic control extension applies to one image only
+                self.frame_delay = 0
+                self.frame_disposal = 0
+                self.frame_transparent = None
+            elif block == 0x3b:
+                return
+            else:
+                raise Exception('Decoding of the GIF failed')
+
+    def _draw(self, canvas, left, top, img_width, right, bottom, palette, indices, transparent):
+        """Draw the rows of the image (color indices) between top and bottom and left and
+        right on the RGB canvas. Pixels with the transparent index are left unchanged."""
+        rgb = self._indices_to_rgb(indices, palette)
+        if transparent is not None:
+            pix = indices.find(transparent)
+            while pix >= 0:
+                xix = left + pix % img_width
+                yix = top + pix // img_width
+                if xix < right and yix < bottom:
+                    off = 3*(yix*self.canvas_width+xix)
+                    rgb[3*pix:3*pix+3] = canvas[off:off+3]
+                pix = indices.find(transparent, pix + 1)
+        row_sz = 3 * (right - left)
+        for yix in range(top, bottom):
+            off = 3 * (yix - top) * img_width
+            canvas[3*(yix*self.canvas_width+left):3*(yix*self.canvas_width+right)] = \
+                rgb[off:off+row_sz]
+
+
+    def _indices_to_rgb(self, indices, palette):
+        """Translate color indices to a bytearray of RGB triplets, using the color table
+        palette (bytes with RGB triplets)."""
+        # translate all pixels at once, one color channel at a time
+        rgb = bytearray(3 * len(indices))
+        for cix in range(3):
+            rgb[cix::3] = indices.translate(bytes(palette[cix::3][:256]).ljust(256, b'\x00'))
+        return rgb
+
+
+class GIFFrame:
+    """A frame of a GIF animation, yielded by GIFReader.iter_frames."""
+
+    frame_num = None
+    width = None
+    height = None
+    # RGB bytes, row by row
+    canvas = None
+    # delay in hundredths of a second before the next frame
+    delay = None
+    disposal = None
+
+    def __init__(self, frame_num, width, height, canvas, delay, disposal):
+        self.frame_num = frame_num
+        self.width = width
+        self.height = height
+        self.canvas = canvas
+        self.delay = delay
+        self.disposal = disposal
+
+    def get_pixel(self, xix, yix):
+        """Return the color of pixel (xix, yix) as list of R, G and B."""
+        off = 3 * (yix * self.width + xix)
+        return list(self.canvas[off:off+3])
@@ -0,0 +1,113 @@
+"""Provides class VideoWall to combine a grid of TimeBoxes into one large display."""
+
+import threading
+from functools import partial
+from time import monotonic
+from timeboximage import TimeBoxImage
+from timeboxgroup import TimeBoxGroup
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class VideoWall(TimeBoxGroup):
+    """Class VideoWall combines columns x rows TimeBoxes into one canvas of 11*columns x
+    11*rows pixels. set_static_image cuts each image into the tiles of the panels and
+    queues them for all panels at once; the thread of each panel encodes its tile and sends
+    it (see GroupMember), so the panels update together. The skew of an image is the time
+    between the first and the last panel having sent its tile. The other methods of
+    TimeBoxGroup send the same message to all panels."""
+
+    TILE_SIZE = 11
+
+    columns = None
+    rows = None
+    width = None
+    height = None
+    panels = None
+
+    # skew statistics, over the images that were sent to all panels
+    ticks = 0
+    skew_last = 0.0
+    skew_total = 0.0
+    skew_max = 0.0
+    MAX_PENDING = 64
+
+    def __init__(self, columns, rows, max_queue=2):
+        TimeBoxGroup.__init__(self, max_queue)
+        self.columns = columns
+        self.rows = rows
+        self.width = columns * self.TILE_SIZE
+        self.height = rows * self.TILE_SIZE
+        self.panels = {}
+        self.lock = threading.Lock()
+        # send times of the tiles by the time their image was queued
+        self.pending = {}
+
+    def add(self, column, row, host=None, port=4, sock=None):
+        """Connect the TimeBox at (column, row) of the grid (see TimeBox.connect). Returns
+        its GroupMember."""
+        if not (0 <= column < self.columns and 0 <= row < self.rows):
+            raise Exception('Illegal panel position')
+        if (column, row) in self.panels:
+            raise Exception('Panel position already taken')
+        member = TimeBoxGroup.add(self, host, port, sock, name='%d,%d' % (column, row))
+        member.on_sent = self._sent
+        self.panels[(column, row)] = member
+        return member
+
+    def tile(self, image, column, row):
+        """Return the tile of the panel at (column, row) of image, a TimeBoxImage, a
+        TimeBoxArrayImage or a (height, width, 3) array with values 0-15."""
+        xix, yix = column * self.TILE_SIZE, row * self.TILE_SIZE
+        data = getattr(image, 'image', image)
+        if isinstance(data, list):
+            tile = TimeBoxImage(self.TILE_SIZE, self.TILE_SIZE)
+            tile.image = [line[xix:xix + self.TILE_SIZE]
+                          for line in data[yix:yix + self.TILE_SIZE]]
+            return tile
+        return np.ascontiguousarray(data[yix:yix + self.TILE_SIZE, xix:xix + self.TILE_SIZE])
+
+    def _size(self, image):
+        """Return the width and height of image (see tile)."""
+        data = getattr(image, 'image', image)
+        if isinstance(data, list):
+            return len(data[0]), len(data)
+        return np.shape(data)[1], np.shape(data)[0]
+
+    def set_static_image(self, image):
+        """Show image, of the size of the wall, on the panels."""
+        if self._size(image) != (self.width, self.height):
+            raise Exception('Image must be %dx%d pixels' % (self.width, self.height))
+        tiles = [(member, self.tile(image, column, row))
+                 for (column, row), member in self.panels.items()]
+        now = monotonic()
+        for member, tile in tiles:
+            member.put(partial(member.timebox.messages.static_image_frame, tile), now, True)
+
+    def _sent(self, queued_at, sent_at):
+        """Record that a panel sent its part of the image queued at queued_at."""
+        with self.lock:
+            times = self.pending.setdefault(queued_at, [])
+            times.append(sent_at)
+            if len(times) == len(self.panels):
+                del self.pending[queued_at]
+                skew = max(times) - min(times)
+                self.ticks += 1
+                self.skew_last = skew
+                self.skew_total += skew
+                self.skew_max = max(self.skew_max, skew)
+            elif len(self.pending) > self.MAX_PENDING:
+                # images some panel dropped are never complete
+                del self.pending[min(self.pending)]
+
+    def skew_stats(self):
+        """Return the skew statistics as a dict."""
+        with self.lock:
+            return {
+                'ticks': self.ticks,
+                'skew_last': self.skew_last,
+                'skew_mean': self.skew_total / self.ticks if self.ticks else 0.0,
+                'skew_max': self.skew_max,
+            }
@@ -2,5 +2,7 @@ from distutils.core import setup, find_packages
 setup(name='timebox',
       version='0.2.3',
       include_package_data=True,
-      py_modules=['timebox', 'timeboximage', 'messages', 'utils/fonts', 'utils/gifreader'],
+      py_modules=['timebox', 'timeboximage', 'messages', 'messageparser', 'asynctimebox',
+                  'timeboxgroup', 'videowall', 'simulator', 'pacing', 'bundle', 'gamma',
+                  'metrics', 'utils/fonts', 'utils/gifreader'],
       )
@@ -0,0 +1,53 @@
+""" Microbenchmark of message framing (checksum, escaping and delimiters) for an
+8 byte command and a 191 byte animation frame, comparing the list based
+implementation that was used before with TimeBoxMessages.frame_message.
+Usage (see helpers.py):
+    python testing/bench_framing.py [repeats]"""
+import sys
+import random
+from helpers import timed
+from messages import TimeBoxMessages
+
+REPEATS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+
+def list_escape_payload(payload):
+    """The original list based escape_payload."""
+    escpayload = []
+    for payload_data in payload:
+        escpayload += \
+            [0x03, payload_data + 0x03] if payload_data in range(0x01, 0x04) else [payload_data]
+    return escpayload
+
+
+def list_make_message(payload):
+    """The original list based make_message."""
+    csum = sum(payload)
+    cs_payload = payload + [csum & 0xff, csum >> 8]
+    return [0x01] + list_escape_payload(cs_payload) + [0x02]
+
+
+def main():
+    """Check the implementations agree and print the timings."""
+    messages = TimeBoxMessages()
+    random.seed(42)
+    command = [0x08, 0x00, 0x45, 0x01, 0x00, 0x02, 0x03, 0xff]
+    frame = [0xbf, 0x00, 0x49, 0x00, 0x0a, 0x0a, 0x04, 0x01, 0x05] + \
+            [random.randrange(256) for _ in range(182)]
+    print('%d repeats' % REPEATS)
+    for name, payload in [('8 byte command', command), ('191 byte animation frame', frame)]:
+        if list(messages.frame_message(bytes(payload))) != list_make_message(payload):
+            raise Exception('Framed messages differ for %s' % name)
+        cases = [
+            ('list make_message', list_make_message, payload),
+            ('frame_message', messages.frame_message, bytes(payload)),
+            ('make_message wrapper', messages.make_message, payload),
+        ]
+        for case_name, function, arg in cases:
+            elapsed = timed(function, REPEATS, arg)
+            print('%-26s %-22s %7.3f s  (%.2f us/message)' % \
+                  (name, case_name, elapsed, 1e6 * elapsed / REPEATS))
+
+
+if __name__ == '__main__':
+    main()
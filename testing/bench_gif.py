@@ -0,0 +1,71 @@
+""" Benchmark GIFReader.read on the test GIFs, the font sprite and a large synthetic GIF,
+report the peak memory allocated while reading, and check that the decoded single frame GIFs equal the decoding by Pillow.
+Usage (see helpers.py):
+    python testing/bench_gif.py [repeats]"""
+import os
+import sys
+import random
+import tempfile
+import tracemalloc
+from PIL import Image
+from helpers import TESTDATA, FONTFILE, timed
+from utils.gifreader import GIFReader
+
+REPEATS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+
+def make_synthetic_gif(fname, size=500):
+    """Write a single frame, non-interlaced GIF with noise on a gradient, using all 256
+    colors and long LZW code streams."""
+    random.seed(42)
+    image = Image.new('RGB', (size, size))
+    image.putdata([(random.randrange(4) * 60, (pix * 3) % 256, (pix // size) % 256)
+                   for pix in range(size * size)])
+    image.quantize(256).save(fname, interlace=False)
+
+
+def check_against_pillow(fname):
+    """Raise an exception if GIFReader and Pillow decode fname differently."""
+    reader = GIFReader()
+    reader.read(fname)
+    with Image.open(fname) as image:
+        rgb = image.convert('RGB')
+        if rgb.tobytes() != reader.get_rgb():
+            raise Exception('%s differs from Pillow' % fname)
+        for xix, yix in [(0, 0), (rgb.size[0] - 1, rgb.size[1] - 1)]:
+            if list(rgb.getpixel((xix, yix))) != reader.output_image[xix][yix]:
+                raise Exception('%s differs from Pillow at (%d, %d)' % (fname, xix, yix))
+
+
+def peak_memory(fname):
+    """Return the peak memory allocated (in KiB) while reading fname and keeping the
+    decoded image."""
+    tracemalloc.start()
+    reader = GIFReader()
+    reader.read(fname)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del reader
+    return peak / 1024.0
+
+
+def main():
+    """Check the decoder against Pillow and print the timings."""
+    synthetic = os.path.join(tempfile.mkdtemp(), 'synthetic.gif')
+    make_synthetic_gif(synthetic)
+    for fname in [FONTFILE, synthetic]:
+        check_against_pillow(fname)
+
+    print('%d repeats' % REPEATS)
+    for fname in [os.path.join(TESTDATA, 'exp.gif'), os.path.join(TESTDATA, 'exp2.gif'),
+                  FONTFILE, synthetic]:
+        with Image.open(fname) as image:
+            size = image.size
+        elapsed = timed(lambda: GIFReader().read(fname), REPEATS) / REPEATS
+        print('%-20s %4dx%-4d %8.2f ms %10.1f KiB peak' % (
+            os.path.basename(fname), size[0], size[1], 1000.0 * elapsed, peak_memory(fname)))
+    os.remove(synthetic)
+
+
+if __name__ == '__main__':
+    main()
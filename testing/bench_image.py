@@ -0,0 +1,60 @@
+""" Benchmark building and encoding TimeBox frames with the list based
+TimeBoxImage and the numpy based TimeBoxArrayImage.
+Usage (see helpers.py):
+    python testing/bench_image.py [frames]"""
+import sys
+import random
+from timeit import default_timer
+import helpers  # puts the package directory on the path
+from timeboximage import TimeBoxImage, TimeBoxArrayImage
+from messages import TimeBoxMessages
+
+FRAMES = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+GAMMA = 0.5
+
+random.seed(42)
+PIXELS = [(random.randrange(11), random.randrange(11),
+           random.randrange(256), random.randrange(256), random.randrange(256))
+          for i in range(64)]
+
+
+def build_frame(image_class):
+    """Build a frame the way the examples do: gamma corrected pixel by pixel."""
+    image = image_class()
+    image.set_gamma(GAMMA)
+    for xix, yix, rval, gval, bval in PIXELS:
+        image.put_pixel_gamma(xix, yix, rval, gval, bval)
+    return image
+
+
+def run(image_class):
+    """Build and encode FRAMES frames. Returns the build and encode times."""
+    messages = TimeBoxMessages()
+    build_time = 0.0
+    encode_time = 0.0
+    for _ in range(FRAMES):
+        start = default_timer()
+        image = build_frame(image_class)
+        mid = default_timer()
+        messages.static_image_message(image)
+        build_time += mid - start
+        encode_time += default_timer() - mid
+    return build_time, encode_time
+
+
+def main():
+    """Run the benchmark and print the results."""
+    messages = TimeBoxMessages()
+    if messages.static_image_message(build_frame(TimeBoxImage)) != \
+            messages.static_image_message(build_frame(TimeBoxArrayImage)):
+        raise Exception('Encoded frames differ')
+    print('%d frames' % FRAMES)
+    for image_class in [TimeBoxImage, TimeBoxArrayImage]:
+        build_time, encode_time = run(image_class)
+        print('%-18s build %7.3f s  encode %7.3f s  total %7.3f s  (%.0f frames/s)' % \
+              (image_class.__name__, build_time, encode_time, build_time + encode_time,
+               FRAMES / (build_time + encode_time)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+""" Benchmark packing images into the 4 bit wire format, comparing the per pixel
+loop that was used before with TimeBoxMessages.pack_image.
+Usage (see helpers.py):
+    python testing/bench_pack.py [frames]"""
+import sys
+import random
+from helpers import timed
+from timeboximage import TimeBoxImage, TimeBoxArrayImage
+from messages import TimeBoxMessages
+
+FRAMES = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+
+def loop_static_image_payload(imag):
+    """The original nested loop implementation of static_image_payload."""
+    resmsg = [0] * (((imag.height * imag.width * 3 + 1) >> 1) + 7)
+    resmsg[0:7] = [0xbd, 0x00, 0x44, 0x00, 0x0a, 0x0a, 0x04]
+    nix = 14
+    for yix in range(imag.height):
+        for xix in range(imag.width):
+            for cix in range(3):
+                pdat = imag.get_pixel_data(xix, yix, cix)
+                if nix&1 != 0:
+                    pdat = pdat << 4
+                resmsg[nix>>1] |= pdat
+                nix = nix + 1
+    return resmsg
+
+
+def random_image(image_class):
+    """Create an image with random colors."""
+    image = image_class()
+    for xix in range(11):
+        for yix in range(11):
+            image.put_pixel(xix, yix, random.randrange(16), random.randrange(16),
+                            random.randrange(16))
+    return image
+
+
+def main():
+    """Check the packers agree and print the timings."""
+    messages = TimeBoxMessages()
+    random.seed(42)
+    legacy = random_image(TimeBoxImage)
+    array = TimeBoxArrayImage()
+    array.blit(legacy)
+    expected = loop_static_image_payload(legacy)
+    for image in [legacy, array, array.image]:
+        if messages.static_image_payload(image) != expected:
+            raise Exception('Packed payload differs for %s' % type(image).__name__)
+
+    print('%d frames' % FRAMES)
+    cases = [
+        ('nested loop, TimeBoxImage', loop_static_image_payload, legacy),
+        # pack_image flattens the nested lists on every call, the pixel_bytes of the image
+        # are only used as key of the message cache
+        ('pack_image, TimeBoxImage', messages.pack_image, legacy),
+        ('pack_image, TimeBoxArrayImage', messages.pack_image, array),
+        ('pack_image, flat bytes', messages.pack_image, messages.pixel_data(legacy)),
+    ]
+    for name, function, image in cases:
+        elapsed = timed(function, FRAMES, image)
+        print('%-30s %7.3f s  (%.1f us/frame)' % (name, elapsed, 1e6 * elapsed / FRAMES))
+
+
+if __name__ == '__main__':
+    main()
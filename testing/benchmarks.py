@@ -0,0 +1,302 @@
+""" Benchmark suite of the hot paths: message encoding and decoding, GIF decoding, font
+rendering, the image conversion of the command line tool and the step functions of the
+examples. Every benchmark is timed in a number of rounds of calibrated loops, with fixed
+random seeds, and the time per call is reported. The results can be written as JSON and
+compared with a stored baseline: a benchmark whose median time exceeds the baseline by more
+than the threshold counts as regression, and makes the exit status 1; a missing baseline
+makes it 2.
+The command line tool and the examples import pybluez. Usage (see helpers.py):
+    python testing/benchmarks.py [--filter TEXT] [--json FILE]
+        [--save-baseline] [--compare [BASELINE]] [--threshold 0.2] [--rounds 5]"""
+import os
+import sys
+import json
+import random
+import argparse
+import platform
+import statistics
+from timeit import Timer
+from helpers import ROOT, TESTDATA, FONTFILE, load_cli
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# the benchmarks by name; each is a function that prepares the data and returns the
+# function to time
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register the decorated setup function as benchmark name."""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def load_example(name):
+    """Import the example module name from the examples directory."""
+    examples = os.path.join(ROOT, 'examples')
+    if examples not in sys.path:
+        sys.path.insert(0, examples)
+    return __import__(name)
+
+
+def random_image():
+    """Return a TimeBoxImage with random colors."""
+    from timeboximage import TimeBoxImage
+    image = TimeBoxImage()
+    for yix in range(11):
+        for xix in range(11):
+            image.put_pixel(xix, yix, random.randrange(16), random.randrange(16),
+                            random.randrange(16))
+    return image
+
+
+@benchmark('messages.static_image_message')
+def bench_static_image_message():
+    """Encode a static image message."""
+    from messages import TimeBoxMessages
+    messages, image = TimeBoxMessages(), random_image()
+    return lambda: messages.static_image_message(image)
+
+
+@benchmark('messages.dynamic_image_message')
+def bench_dynamic_image_message():
+    """Encode an animation frame message."""
+    from messages import TimeBoxMessages
+    messages, image = TimeBoxMessages(), random_image()
+    return lambda: messages.dynamic_image_message(image, 3, 10)
+
+
+def image_payload():
+    """Return the payload of a static image message with random colors."""
+    from messages import TimeBoxMessages
+    return TimeBoxMessages().static_image_payload(random_image())
+
+
+@benchmark('messages.escape_payload')
+def bench_escape_payload():
+    """Escape the payload of an image message."""
+    from messages import TimeBoxMessages
+    messages, payload = TimeBoxMessages(), image_payload()
+    return lambda: messages.escape_payload(payload)
+
+
+@benchmark('messages.unescape')
+def bench_unescape():
+    """Unescape the payload of an image message."""
+    from messages import TimeBoxMessages
+    messages = TimeBoxMessages()
+    data = messages.escape_payload(image_payload())
+    return lambda: messages.unescape(data)
+
+
+@benchmark('messages.decode')
+def bench_decode():
+    """Decode an image message."""
+    from messages import TimeBoxMessages
+    messages = TimeBoxMessages()
+    msg = messages.make_message(image_payload())
+    return lambda: messages.decode(msg)
+
+
+def bench_gif(fname):
+    """Return the setup of the benchmark of reading fname."""
+    def setup():
+        from utils.gifreader import GIFReader
+        return lambda: GIFReader().read(fname)
+    return setup
+
+
+for GIF in ['exp.gif', 'exp2.gif']:
+    benchmark('gifreader.read ' + GIF)(bench_gif(os.path.join(TESTDATA, GIF)))
+benchmark('gifreader.read arcadeclassic.gif')(bench_gif(FONTFILE))
+
+
+@benchmark('fonts.get_pixel text')
+def bench_fonts_get_pixel():
+    """Get the pixels of a text one by one."""
+    from utils.fonts import Fonts
+    font = Fonts(FONTFILE, 9, 9, 10, 0.6, cache_dir=None)
+    text = 'HELLOTIMEBOX'
+
+    def render():
+        """Get all pixels of the text."""
+        for char in text:
+            for xix in range(font.font_width):
+                for yix in range(font.font_height):
+                    font.get_pixel(char, xix, yix)
+    return render
+
+
+@benchmark('fonts.TextRenderer marquee')
+def bench_text_renderer():
+    """Render the images of a marquee with TextRenderer."""
+    from utils.fonts import Fonts, TextRenderer
+    renderer = TextRenderer(Fonts(FONTFILE, 9, 9, 10, 0.6, cache_dir=None), 'HELLOTIMEBOX')
+    return lambda: list(renderer.frames())
+
+
+@benchmark('cli.process_image')
+def bench_cli_process_image():
+    """Convert an image to the wire format in the command line tool."""
+    from PIL import Image
+    cli = load_cli()
+    image = Image.open(os.path.join(TESTDATA, 'color.png')).convert('RGBA')
+    return lambda: cli.process_image(image, 11, Image.BICUBIC)
+
+
+@benchmark('cli.conv_image')
+def bench_cli_conv_image():
+    """Create an image message in the command line tool."""
+    from PIL import Image
+    cli = load_cli()
+    data = cli.process_image(Image.open(os.path.join(TESTDATA, 'skull.png')).convert('RGBA'))
+    return lambda: cli.conv_image(data)
+
+
+@benchmark('cli.prepare_animation')
+def bench_cli_prepare_animation():
+    """Create the messages of an animation in the command line tool."""
+    cli = load_cli()
+    folder = os.path.join(TESTDATA, 'exp')
+    frames = list(cli.load_animation_frames('folder', folder))
+    return lambda: cli.prepare_animation(frames, 10)
+
+
+@benchmark('examples.GameOfLife.iterate')
+def bench_game_of_life():
+    """Compute a generation of the Game of Life."""
+    life = load_example('life')
+    game = life.GameOfLife()
+    game.randomize_board()
+    board = game.board
+
+    def iterate():
+        """Iterate from the same board every time."""
+        game.board = board
+        game.iterate()
+    return iterate
+
+
+@benchmark('examples.Diffuse.apply_kernel')
+def bench_diffuse():
+    """Apply the diffusion kernel."""
+    diffuse = load_example('diffuse').Diffuse()
+    for _ in range(5):
+        diffuse.add_random_dot()
+    image = diffuse.image
+
+    def apply_kernel():
+        """Apply the kernel to the same image every time."""
+        diffuse.image = image
+        diffuse.apply_kernel()
+    return apply_kernel
+
+
+@benchmark('examples.JacobiIteration.iterate')
+def bench_jacobi():
+    """Perform a Jacobi rotation."""
+    jacobi = load_example('jacobi').JacobiIteration()
+    jacobi.randomize_matrix()
+    matrix = jacobi.matrix
+
+    def iterate():
+        """Iterate from the same matrix every time."""
+        jacobi.matrix = matrix
+        jacobi.iterate()
+    return iterate
+
+
+def run(name, rounds):
+    """Time benchmark name. Returns its results as a dict, times in seconds per call."""
+    random.seed(1234)
+    func = BENCHMARKS[name]()
+    timer = Timer(func)
+    # calibrate the loop to take at least 0.2 seconds
+    loops, _ = timer.autorange()
+    times = [timer.timeit(loops) / loops for _ in range(rounds)]
+    return {
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+        'stdev': statistics.stdev(times) if rounds > 1 else 0.0,
+        'loops': loops,
+        'rounds': rounds,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print the comparison of results with baseline. Returns the names of the benchmarks
+    that regressed by more than threshold (a fraction)."""
+    regressions = []
+    print('\n%-38s %12s %12s %8s' % ('compared with baseline', 'baseline', 'now', 'ratio'))
+    for name in sorted(results):
+        if name not in baseline:
+            print('%-38s %12s %10.2f us %8s' % (name, '-', 1e6 * results[name]['median'], 'new'))
+            continue
+        ratio = results[name]['median'] / baseline[name]['median']
+        flag = ''
+        if ratio > 1.0 + threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        elif ratio < 1.0 - threshold:
+            flag = '  improved'
+        print('%-38s %10.2f us %10.2f us %8.2f%s' % (name, 1e6 * baseline[name]['median'],
+                                                     1e6 * results[name]['median'], ratio,
+                                                     flag))
+    return regressions
+
+
+def main():
+    """Run the selected benchmarks, report and compare them."""
+    parser = argparse.ArgumentParser(description='Benchmark the TimeBox hot paths.')
+    parser.add_argument('--filter', default='', help='only run benchmarks containing TEXT')
+    parser.add_argument('--rounds', type=int, default=5, help='timed rounds per benchmark')
+    parser.add_argument('--json', help='write the results to FILE')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store the results as baseline')
+    parser.add_argument('--compare', nargs='?', const=BASELINE,
+                        help='compare with the baseline (default %s)' % BASELINE)
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='slowdown counted as regression, as fraction')
+    args = parser.parse_args()
+
+    results = {}
+    print('%-38s %12s %12s %8s' % ('benchmark', 'median', 'min', 'stdev'))
+    for name in sorted(BENCHMARKS):
+        if args.filter in name:
+            results[name] = run(name, args.rounds)
+            print('%-38s %10.2f us %10.2f us %6.1f %%' % (
+                name, 1e6 * results[name]['median'], 1e6 * results[name]['min'],
+                100.0 * results[name]['stdev'] / results[name]['mean']))
+
+    report = {
+        'machine': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(),
+        },
+        'benchmarks': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(BASELINE, 'w') as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+    if args.compare:
+        try:
+            with open(args.compare) as file:
+                baseline = json.load(file)['benchmarks']
+        except FileNotFoundError:
+            print('no baseline %s, run with --save-baseline first' % args.compare,
+                  file=sys.stderr)
+            sys.exit(2)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+""" Check that bundle files hold exactly the messages the live encoders send: the bundles
+written by the makebundle command of the command line tool against prepare_animation and
+conv_image, and the bundles written by Bundle.write against
+TimeBoxMessages.dynamic_image_frame.
+The tool imports pybluez. Usage (see helpers.py):
+    python testing/check_bundle.py"""
+import os
+import sys
+import random
+import socket
+import tempfile
+import threading
+import subprocess
+from helpers import TESTDATA, CLI, load_cli
+from bundle import Bundle
+from messages import TimeBoxMessages
+from timebox import TimeBox
+from timeboximage import TimeBoxImage
+
+
+def check_cli_bundle(cli, tmpdir, source, path, static, delay):
+    """Write a bundle with makebundle and compare it with the live encoder."""
+    fname = os.path.join(tmpdir, 'cli.tbx')
+    args = [sys.executable, CLI, 'offline', 'makebundle', '--' + source, '--delay', str(delay)]
+    if static:
+        args.append('--static')
+    subprocess.check_call(args + [path, fname])
+
+    frames = list(cli.load_animation_frames(source, path))
+    if static:
+        expected = [bytes(bytearray(cli.conv_image(frame))) for frame in frames]
+    else:
+        expected = [bytes(bytearray(msg)) for msg in cli.prepare_animation(frames, delay)]
+
+    with Bundle(fname) as bundle:
+        if [bytes(msg) for msg in bundle] != expected:
+            raise Exception('the messages differ from the live encoder')
+        if bundle.static != static or bundle.delay != delay or \
+                bundle.source_hash != cli.source_hash(source, path):
+            raise Exception('the header does not match the makebundle options')
+    print('makebundle --%s%s %s: %d messages equal' % (
+        source, ' --static' if static else '', os.path.basename(path), len(expected)))
+
+
+def random_image():
+    """Return a TimeBoxImage with random colors."""
+    image = TimeBoxImage()
+    for yix in range(11):
+        for xix in range(11):
+            image.put_pixel(xix, yix, random.randrange(16), random.randrange(16),
+                            random.randrange(16))
+    return image
+
+
+def check_package_bundle(tmpdir):
+    """Write a bundle with Bundle.write, compare it with dynamic_image_frame and play it
+    with TimeBox.play_bundle."""
+    messages = TimeBoxMessages()
+    expected = [bytes(messages.dynamic_image_frame(random_image(), fnum, 20))
+                for fnum in range(30)]
+    fname = os.path.join(tmpdir, 'package.tbx')
+    Bundle.write(fname, expected, delay=20, source_hash=b'0123456789abcdef')
+    with Bundle(fname) as bundle:
+        if [bytes(msg) for msg in bundle] != expected:
+            raise Exception('Bundle: the messages differ from dynamic_image_frame')
+        if bundle.static or bundle.delay != 20 or bundle.source_hash != b'0123456789abcdef':
+            raise Exception('Bundle: wrong header')
+
+    sock, device = socket.socketpair()
+    received = bytearray()
+
+    def drain():
+        """Read from the device end until it is closed."""
+        while True:
+            data = device.recv(65536)
+            if not data:
+                return
+            received.extend(data)
+    thread = threading.Thread(target=drain)
+    thread.start()
+    timebox = TimeBox()
+    timebox.connect(sock=sock)
+    timebox.play_bundle(fname)
+    timebox.close()
+    thread.join()
+    device.close()
+    if bytes(received) != b''.join(expected):
+        raise Exception('play_bundle did not send the messages of the bundle')
+    print('Bundle.write: %d messages equal, play_bundle sent them unchanged' % len(expected))
+
+
+def main():
+    """Run the checks."""
+    random.seed(1234)
+    cli = load_cli()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        check_cli_bundle(cli, tmpdir, 'folder', os.path.join(TESTDATA, 'exp'), False, 50)
+        check_cli_bundle(cli, tmpdir, 'folder', os.path.join(TESTDATA, 'exp'), True, 200)
+        check_cli_bundle(cli, tmpdir, 'gif', os.path.join(TESTDATA, 'exp2.gif'), False, 0)
+        check_package_bundle(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+""" Check that process_image of the command line tool converts the test images to the
+same bytes as the per pixel loop it replaced, and compare their speed.
+The tool imports pybluez. Usage (see helpers.py):
+    python testing/check_cli_image.py [repeats]"""
+import os
+import sys
+from itertools import product
+from PIL import Image
+from helpers import TESTDATA, timed, load_cli
+
+REPEATS = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+
+def loop_process_image(imagedata, sz=11, scale=None):
+    """The original per pixel implementation of process_image."""
+    img = [0]
+    first = True
+    if scale:
+        src = imagedata.resize((sz, sz), scale)
+    else:
+        src = imagedata.resize((sz, sz))
+    for yix, xix in product(range(sz), range(sz)):
+        r, g, b, a = src.getpixel((xix, yix))
+        if first:
+            img[-1] = ((r&0xf0)>>4)+(g&0xf0) if a > 32 else 0
+            img.append((b&0xf0)>>4) if a > 32 else img.append(0)
+            first = False
+        else:
+            img[-1] += (r&0xf0) if a > 32 else 0
+            img.append(((g&0xf0)>>4)+(b&0xf0)) if a > 32 else img.append(0)
+            img.append(0)
+            first = True
+    return img
+
+
+def main():
+    """Check the conversions at a few sizes and scaling filters, and print the timings."""
+    cli = load_cli()
+    cases = [(name, sz, scale) for name in ['color.png', 'skull.png']
+             for sz in [11, 16, 64] for scale in [None, Image.NEAREST, Image.LANCZOS]]
+    for name, sz, scale in cases:
+        with Image.open(os.path.join(TESTDATA, name)) as image:
+            image = image.convert('RGBA')
+            if cli.process_image(image, sz, scale) != loop_process_image(image, sz, scale):
+                raise Exception('%s differs at size %d, scale %s' % (name, sz, scale))
+    print('%d conversions equal' % len(cases))
+
+    print('%d repeats' % REPEATS)
+    for name in ['color.png', 'skull.png']:
+        with Image.open(os.path.join(TESTDATA, name)) as image:
+            image = image.convert('RGBA')
+            for sz in [11, 64]:
+                loop = timed(loop_process_image, REPEATS, image, sz) / REPEATS
+                bulk = timed(cli.process_image, REPEATS, image, sz) / REPEATS
+                print('%-10s %3dx%-3d loop %8.3f ms   bulk %8.3f ms' % (
+                    name, sz, sz, 1000.0 * loop, 1000.0 * bulk))
+
+
+if __name__ == '__main__':
+    main()
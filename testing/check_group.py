@@ -0,0 +1,117 @@
+""" Drive a TimeBoxGroup with local socketpairs standing in for TimeBoxes: two devices
+that read everything, one that stops reading and one that is disconnected. Checks that
+the reading devices get every message while the others fall behind or fail, and prints
+the statistics of the group. Then sends an animation with more frames than the queue
+holds, which the reading devices must receive completely.
+Needs pybluez. Usage (see helpers.py):
+    python testing/check_group.py [frames]"""
+import sys
+import socket
+import threading
+from time import monotonic, sleep
+import helpers  # puts the package directory on the path
+from timeboximage import TimeBoxImage
+from timeboxgroup import TimeBoxGroup
+
+FRAMES = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+
+def drain(sock, received):
+    """Read from sock until it is closed, collecting the data in received."""
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            return
+        received += data
+
+
+def make_group(names):
+    """Create a TimeBoxGroup with a socketpair per name. Returns the group and the device
+    ends of the socketpairs by name."""
+    group = TimeBoxGroup()
+    ends = {}
+    for name in names:
+        sock, device = socket.socketpair()
+        # small buffers, so the stalled device blocks soon
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        device.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        group.add(sock=sock, name=name)
+        ends[name] = device
+    return group, ends
+
+
+def start_readers(ends, names):
+    """Read from the device ends of names in threads. Returns the data they receive by
+    name."""
+    received = dict((name, bytearray()) for name in names)
+    for name in received:
+        thread = threading.Thread(target=drain, args=(ends[name], received[name]))
+        thread.daemon = True
+        thread.start()
+    return received
+
+
+def check_frames():
+    """Send the frames to the group and check what the stand-ins received."""
+    group, ends = make_group(['reader1', 'reader2', 'stalled', 'disconnected'])
+    ends['disconnected'].close()
+    received = start_readers(ends, ['reader1', 'reader2'])
+
+    expected = bytearray()
+    start = monotonic()
+    for fnum in range(FRAMES):
+        image = TimeBoxImage()
+        image.put_pixel(fnum % 11, (fnum // 11) % 11, 15, fnum % 16, 3)
+        expected += group.messages.static_image_frame(image)
+        group.set_static_image(image)
+        # at most 500 frames per second, the readers keep up with that
+        sleep(0.002)
+    produced = monotonic() - start
+    if group.flush(0.5):
+        raise Exception('the stalled device did not stall')
+
+    stats = group.stats()
+    for name in sorted(stats):
+        print(name, stats[name])
+    print('%d frames queued in %.3f s' % (FRAMES, produced))
+    for name in received:
+        if received[name] != expected:
+            raise Exception('%s did not receive all frames' % name)
+    if stats['stalled']['dropped'] == 0 or stats['disconnected']['error'] is None:
+        raise Exception('the stalled and disconnected devices were not isolated')
+    group.close()
+
+
+def check_animation():
+    """Send an animation longer than the queue and check that the reading devices received
+    every frame."""
+    group, ends = make_group(['reader1', 'reader2', 'stalled'])
+    received = start_readers(ends, ['reader1', 'reader2'])
+    images = []
+    for fnum in range(3 * group.max_queue + 6):
+        image = TimeBoxImage()
+        image.put_pixel(fnum % 11, 5, 15, 0, fnum % 16)
+        images.append(image)
+    expected = bytearray()
+    for fnum, image in enumerate(images):
+        expected += group.messages.dynamic_image_frame(image, fnum, 10)
+    group.set_dynamic_images(images, 10)
+    group.show_clock()
+    expected += group.messages.frame_message(group.messages.command_payload(
+        'set view', [0x00, 0x01]))
+    group.flush(0.5)
+    print('animation of %d frames:' % len(images), group.stats())
+    for name in received:
+        if received[name] != expected:
+            raise Exception('%s did not receive the whole animation' % name)
+    group.close()
+
+
+def main():
+    """Run the checks."""
+    check_frames()
+    check_animation()
+
+
+if __name__ == '__main__':
+    main()
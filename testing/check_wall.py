@@ -0,0 +1,74 @@
+""" Drive a 3x2 VideoWall with local socketpairs standing in for the TimeBoxes. Checks that
+every panel receives exactly the messages of its tiles, encoded separately, and prints the
+skew between the panels.
+Needs pybluez. Usage (see helpers.py):
+    python testing/check_wall.py [frames]"""
+import sys
+import socket
+import threading
+from time import sleep
+import helpers  # puts the package directory on the path
+from timeboximage import TimeBoxImage
+from messages import TimeBoxMessages
+from videowall import VideoWall
+
+FRAMES = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+COLUMNS, ROWS = 3, 2
+
+
+def drain(sock, received):
+    """Read from sock until it is closed, collecting the data in received."""
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            return
+        received += data
+
+
+def make_image(fnum, width, height):
+    """Return a frame of a diagonal bar moving over the whole canvas."""
+    image = TimeBoxImage(height, width)
+    for yix in range(height):
+        for xix in range(width):
+            if (xix + yix + fnum) % 8 < 2:
+                image.put_pixel(xix, yix, 15, (xix * 15) // width, (yix * 15) // height)
+    return image
+
+
+def main():
+    """Send the frames to the wall and check what each panel received."""
+    wall = VideoWall(COLUMNS, ROWS)
+    received = {}
+    for column in range(COLUMNS):
+        for row in range(ROWS):
+            sock, device = socket.socketpair()
+            wall.add(column, row, sock=sock)
+            received[(column, row)] = bytearray()
+            thread = threading.Thread(target=drain, args=(device, received[(column, row)]))
+            thread.daemon = True
+            thread.start()
+
+    messages = TimeBoxMessages()
+    expected = dict((pos, bytearray()) for pos in received)
+    for fnum in range(FRAMES):
+        image = make_image(fnum, wall.width, wall.height)
+        for (column, row) in expected:
+            expected[(column, row)] += \
+                messages.static_image_frame(wall.tile(image, column, row))
+        wall.set_static_image(image)
+        # at most 100 frames per second, so no panel drops frames
+        sleep(0.01)
+    if not wall.flush(5.0):
+        raise Exception('the panels did not keep up')
+    sleep(0.1)
+
+    for pos in sorted(received):
+        if received[pos] != expected[pos]:
+            raise Exception('panel %d,%d received other data' % pos)
+    print('%d frames on %d panels' % (FRAMES, len(received)))
+    print(wall.skew_stats())
+    wall.close()
+
+
+if __name__ == '__main__':
+    main()
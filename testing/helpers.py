@@ -0,0 +1,34 @@
+""" Helpers shared by the benchmark and check scripts in this directory. Importing this module
+puts the package directory on the path, so the scripts run from the repository root as
+    python testing/<script>.py
+The scripts that use the command line tool or the TimeBox classes need pybluez."""
+import os
+import sys
+import importlib.util
+from timeit import default_timer
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+TESTDATA = os.path.join(ROOT, 'testdata')
+FONTFILE = os.path.join(ROOT, 'examples', 'fonts', 'arcadeclassic.gif')
+CLI = os.path.join(ROOT, 'timebox', 'timebox.py')
+
+PACKAGE = os.path.join(ROOT, 'package')
+if PACKAGE not in sys.path:
+    # after the directory of the script
+    sys.path.insert(1, PACKAGE)
+
+
+def timed(func, repeats, *args):
+    """Return the time of repeats calls of func(*args), in seconds."""
+    start = default_timer()
+    for _ in range(repeats):
+        func(*args)
+    return default_timer() - start
+
+
+def load_cli():
+    """Load timebox/timebox.py, which shares its module name with the package."""
+    spec = importlib.util.spec_from_file_location('timebox_cli', CLI)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -1,23 +1,49 @@
 import bluetooth
 import time
+import os
+import sys
+import socket
+import select
 import click
 import math
+import hashlib
 from colour import Color
-from itertools import product
 from os import listdir
 from os.path import isfile, join
-from PIL import Image
 from binascii import unhexlify
+from functools import partial
 from math import modf
+try:
+    from bundle import Bundle
+    from pacing import FramePacer
+except ImportError:
+    # run from the repository, without the package installed
+    sys.path.append(join(os.path.dirname(os.path.abspath(__file__)), '..', 'package'))
+    from bundle import Bundle
+    from pacing import FramePacer
+
+# Pillow is imported where it is needed, so playing bundles does not load it
 
 class Timebox:
+    # addr is a bluetooth address, or tcp:HOST:PORT or unix:PATH (e.g. for the simulator)
     debug=False
     def __init__(self, addr):
-        self.sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
+        if addr.startswith('tcp:'):
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        elif addr.startswith('unix:'):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
         self.addr = addr
 
     def connect(self):
-        self.sock.connect((self.addr, 4))
+        if self.addr.startswith('tcp:'):
+            host, port = self.addr[4:].rsplit(':', 1)
+            self.sock.connect((host, int(port)))
+        elif self.addr.startswith('unix:'):
+            self.sock.connect(self.addr[5:])
+        else:
+            self.sock.connect((self.addr, 4))
 
     def disconnect(self):
         self.sock.close()
@@ -25,11 +51,54 @@ class Timebox:
     def send(self, package):
         if(self.debug):
             print([hex(b)[2:].zfill(2) for b in package])
-        self.sock.send(str(bytearray(package)))
+        self.sock.send(bytes(bytearray(package)))
 
     def send_raw(self, bts):
         self.sock.send(bts)
 
+    def send_all(self, bts):
+        view = memoryview(bts)
+        while len(view):
+            view = view[self.sock.send(view):]
+
+
+class DaemonConnection:
+    # stands in for Timebox, passing the messages through a running "serve" daemon
+    debug=False
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.path = path
+
+    def connect(self):
+        self.sock.connect(self.path)
+
+    def disconnect(self):
+        # the daemon reports whether everything reached the timebox
+        self.sock.shutdown(socket.SHUT_WR)
+        reply = b''
+        while True:
+            data = self.sock.recv(1024)
+            if not data:
+                break
+            reply += data
+        self.sock.close()
+        if not reply.startswith(b'OK'):
+            raise click.ClickException('daemon: ' + reply.decode('utf-8', 'replace').strip())
+
+    def send(self, package):
+        if(self.debug):
+            print([hex(b)[2:].zfill(2) for b in package])
+        self.sock.sendall(bytes(bytearray(package)))
+
+    def send_raw(self, bts):
+        self.sock.sendall(bts)
+
+    def send_all(self, bts):
+        self.sock.sendall(bts)
+
+
+# commands that do not talk to the timebox, the address is ignored
+OFFLINE_COMMANDS = ["makebundle"]
 
 VIEWTYPES = {
             "clock": 0x00,
@@ -48,10 +117,21 @@ VIEWTYPES = {
 @click.option('--debug', is_flag=True)
 @click.option('--disconnect', 'disconnect', flag_value=True, default=True)
 @click.option('--keepconnected', 'disconnect', flag_value=False, default=True)
+@click.option('--socket', 'socket_path', help="unix socket of the serve daemon")
 @click.pass_context
-def cli(ctx, address, debug,disconnect):
+def cli(ctx, address, debug,disconnect,socket_path):
     ctx.obj['address']=address
-    dev = connect(ctx.obj['address'])
+    ctx.obj['socket']=socket_path or daemon_socket_path(address)
+    if ctx.invoked_subcommand in OFFLINE_COMMANDS:
+        return None, False
+    dev = None
+    if ctx.invoked_subcommand != 'serve':
+        # use the connection of a running daemon, it saves connecting over bluetooth
+        dev = connect_daemon(ctx.obj['socket'])
+        if dev is not None:
+            ctx.call_on_close(dev.disconnect)
+    if dev is None:
+        dev = connect(ctx.obj['address'])
     if(debug):
         dev.debug=True
     ctx.obj['dev']=dev
@@ -162,103 +242,86 @@ def set_temp_color(r,g,b,x,f=False):
     return msg
 
 
-def analyseImage(im):
+def getFrames(im):
     '''
-    Pre-process pass over the image to determine the mode (full or additive).
-    Necessary as assessing single frames isn't reliable. Need to know the mode
-    before processing all frames.
+    Iterate the GIF in a single pass, yielding each frame as RGBA image.
+    Pillow composites the frames of partial-mode GIFs onto the preceding frames
+    and applies the global palette where frames have no local one.
     '''
-    results = {
-        'size': im.size,
-        'mode': 'full',
-    }
     try:
         while True:
-            if im.tile:
-                tile = im.tile[0]
-                update_region = tile[1]
-                update_region_dimensions = update_region[2:]
-                if update_region_dimensions != im.size:
-                    results['mode'] = 'partial'
-                    break
+            yield im.convert('RGBA')
             im.seek(im.tell() + 1)
     except EOFError:
         pass
-    im.seek(0)
-    return results
 
 
-def getFrames(im):
-    '''
-    Iterate the GIF, extracting each frame.
-    '''
-    mode = analyseImage(im)['mode']
-
-    p = im.getpalette()
-    last_frame = im.convert('RGBA')
-
-    try:
-        while True:
-            '''
-            If the GIF uses local colour tables, each frame will have its own palette.
-            If not, we need to apply the global palette to the new frame.
-            '''
-            if not im.getpalette():
-                im.putpalette(p)
-
-            new_frame = Image.new('RGBA', im.size)
-
-            '''
-            Is this file a "partial"-mode GIF where frames update a region of a different size to the entire image?
-            If so, we need to construct the new frame by pasting it on top of the preceding frames.
-            '''
-            if mode == 'partial':
-                new_frame.paste(last_frame)
-
-            new_frame.paste(im, (0,0), im.convert('RGBA'))
-            yield new_frame
-
-            last_frame = new_frame
-            im.seek(im.tell() + 1)
-    except EOFError:
-        pass
+# translation tables: alpha to a byte mask of the visible pixels (alpha above 32), a
+# color value to its high nibble, and a nibble to the high nibble of a byte
+ALPHA_MASK = bytes(0xff if a > 32 else 0x00 for a in range(256))
+TO_NIBBLE = bytes(v >> 4 for v in range(256))
+TO_HIGH_NIBBLE = bytes((v & 0x0f) << 4 for v in range(256))
 
+def pack_nibbles(nibbles):
+    # two nibbles per byte, the first one in the low four bits
+    nibbles = bytes(nibbles)
+    if len(nibbles) & 1:
+        nibbles += b'\x00'
+    low = int.from_bytes(nibbles[0::2], 'little')
+    high = int.from_bytes(nibbles[1::2].translate(TO_HIGH_NIBBLE), 'little')
+    return (low | high).to_bytes(len(nibbles) // 2, 'little')
 
 def process_image(imagedata,sz=11,scale=None):
-    img = [0]
-    bc = 0
-    first=True
-    
     if(scale):
         src = imagedata.resize((sz, sz), scale)
     else:
         src = imagedata.resize((sz, sz))
-        
-    for c in product(range(sz),range(sz)):
-        y,x = c
-        r,g,b,a = src.getpixel((x,y))
-            
-        if(first):
-            img[-1] = ((r&0xf0)>>4)+(g&0xf0) if a>32 else 0
-            img.append((b&0xf0)>>4) if a>32 else img.append(0)
-            first=False
-        else:
-            img[-1] += (r&0xf0) if a>32 else 0
-            img.append(((g&0xf0)>>4)+(b&0xf0)) if a>32 else img.append(0)
-            img.append(0)
-            first=True
-        bc += 1
+    if src.mode != 'RGBA':
+        src = src.convert('RGBA')
+
+    # all pixels at once: mask out the transparent ones, one color channel at a time
+    rgba = src.tobytes()
+    npix = sz * sz
+    visible = int.from_bytes(rgba[3::4].translate(ALPHA_MASK), 'little')
+    nibbles = bytearray(3 * npix)
+    for c in range(3):
+        chan = int.from_bytes(rgba[c::4], 'little') & visible
+        nibbles[c::3] = chan.to_bytes(npix, 'little').translate(TO_NIBBLE)
+    img = list(pack_nibbles(nibbles))
+    # the image data always ends with a started byte, an empty one for an even pixel count
+    if len(img) * 2 == len(nibbles):
+        img.append(0)
     return img
 
 
 def load_image(file, sz=11, scale=None):
+    from PIL import Image
     with Image.open(file).convert("RGBA") as imagedata:
         return process_image(imagedata,sz)
     
-def load_gif_frames(file,sz=11,scale=None):
+def load_gif_frames(file,sz=11,scale=None,jobs=1):
+    from PIL import Image
     with Image.open(file) as imagedata:
-        for f in getFrames(imagedata):
-            yield process_image(f,sz,scale)
+        convert = partial(process_image, sz=sz, scale=scale)
+        for f in convert_frames(convert, getFrames(imagedata), jobs):
+            yield f
+
+def convert_frames(convert, items, jobs=1):
+    # apply convert to the items in order, in a pool of jobs processes if jobs > 1;
+    # the results are yielded as soon as they are ready, in the order of the items
+    if jobs <= 1:
+        for item in items:
+            yield convert(item)
+        return
+    from multiprocessing import Pool
+    pool = Pool(jobs)
+    try:
+        for result in pool.imap(convert, items, chunksize=2):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
 
 
 def conv_image(data):    
@@ -272,47 +335,105 @@ def conv_image(data):
 
 
 def prepare_animation(frames, delay=0):
+    return list(animation_messages(frames, delay))
+
+def animation_messages(frames, delay=0):
     head = [0xbf,0x00,0x49,0x00,0x0a,0x0a,0x04]
     
-    ret = []
-    
     fi = 0
     for f in frames:
         _head = head+[fi,delay]
         ck1,ck2 = checksum(sum(_head)+sum(f))
         msg=[0x01]+mask(_head)+mask(f)+mask([ck1,ck2])+[0x02]
         fi+=1
-        ret.append(msg)
-        
-    return ret
+        yield msg
 
 @cli.command(short_help='display_image')
 @click.argument('file', nargs=1)
 @click.pass_context
 def image(ctx, file):
+    from PIL import Image
     ctx.obj['dev'].send(conv_image(load_image(file,scale=Image.BICUBIC)))
     
     
+def load_animation_frames(source, path, jobs=1):
+    # yields the frames as they are converted; the files of a folder in name order
+    from PIL import Image
+    
+    if(source=="folder"):
+        files = [join(path, f) for f in sorted(listdir(path))]
+        for f in convert_frames(load_image, [f for f in files if isfile(f)], jobs):
+            yield f
+    elif(source=="gif"):
+        for f in load_gif_frames(path,11,scale=Image.BICUBIC,jobs=jobs):
+            yield f
+
+
 @cli.command(short_help='display_animation')
 @click.option('--gif', 'source', flag_value='gif')
 @click.option('--folder', 'source', flag_value='folder',default=True)
 @click.option('--delay', nargs=1)
+@click.option('--jobs', type=int, default=1, help="convert the frames in N processes")
 @click.argument('path', nargs=1)
 @click.pass_context
-def animation(ctx, source, path, delay):
-    frames = []
+def animation(ctx, source, path, delay, jobs):
+    frames = load_animation_frames(source, path, jobs)
     
+    # frames are sent as soon as they are converted
+    for f in animation_messages(frames,delay=int(delay) if delay else 0):
+        ctx.obj['dev'].send(f)
+
+
+# Bundles store ready to send messages, see doc/bundle.md and package/bundle.py
+def source_hash(source, path):
+    h = hashlib.sha256()
     if(source=="folder"):
-        for f in listdir(path):
+        for f in sorted(listdir(path)):
             f=join(path, f)
             if isfile(f):
-                frames.append(load_image(f))
-    elif(source=="gif"):
-        for f in load_gif_frames(path,11,scale=Image.BICUBIC):
-            frames.append(f)
-    
-    for f in prepare_animation(frames,delay=int(delay) if delay else 0):
-        ctx.obj['dev'].send(f)
+                with open(f, 'rb') as data:
+                    h.update(data.read())
+    else:
+        with open(path, 'rb') as data:
+            h.update(data.read())
+    return h.digest()[:16]
+
+
+@cli.command(short_help='pre-encode an animation into a bundle file')
+@click.option('--gif', 'source', flag_value='gif')
+@click.option('--folder', 'source', flag_value='folder',default=True)
+@click.option('--static', is_flag=True, help="store static images, shown --delay ms apart")
+@click.option('--delay', nargs=1)
+@click.option('--jobs', type=int, default=1, help="convert the frames in N processes")
+@click.argument('path', nargs=1)
+@click.argument('output', nargs=1)
+@click.pass_context
+def makebundle(ctx, source, path, output, delay, static, jobs):
+    frames = load_animation_frames(source, path, jobs)
+    delay = int(delay) if delay else 0
+    if(static):
+        messages = [conv_image(f) for f in frames]
+    else:
+        messages = prepare_animation(frames, delay=delay)
+    Bundle.write(output, [bytes(bytearray(m)) for m in messages], delay, static,
+                 source_hash(source, path))
+
+
+@cli.command(short_help='play a bundle file')
+@click.argument('file', nargs=1)
+@click.pass_context
+def bundle(ctx, file):
+    try:
+        frames = Bundle(file)
+    except Exception as err:
+        raise click.ClickException('%s: %s' % (file, err))
+    with frames:
+        # static images are shown the delay apart, animation frames sent right away
+        pacer = FramePacer(1000.0 / frames.delay) if frames.static and frames.delay else None
+        for msg in frames:
+            if pacer is not None:
+                pacer.wait()
+            ctx.obj['dev'].send_all(msg)
 
 
 # TODO: a bit weird, if the animation has "less frames than usual", it might be "glued" to the previous ;)
@@ -332,11 +453,11 @@ def fmradio(ctx, state, frequency):
             frac=int(frac*100)
             whole=(int(whole))
             f=[whole,frac]
-            print f
-            print mask(f)
+            print(f)
+            print(mask(f))
             ck1,ck2 = checksum(sum(head)+sum(f))
-            print [ck1,ck2]
-            print mask([ck1,ck2])
+            print([ck1,ck2])
+            print(mask([ck1,ck2]))
             ctx.obj['dev'].send([0x01]+head+mask(f)+mask([ck1,ck2])+[0x02])
     else:
         ctx.obj['dev'].send([0x01]+mask([0x04,0x00,0x05,0x00,0x09,0x00])+[0x02])
@@ -360,6 +481,120 @@ def connect(address):
     return dev
 
 
+def daemon_socket_path(address):
+    # one daemon per timebox, in the runtime directory of the user
+    directory = os.environ.get('XDG_RUNTIME_DIR') or '/tmp'
+    name = 'timebox-%s-%d.sock' % (''.join(c for c in address.lower() if c.isalnum()),
+                                   os.getuid())
+    return join(directory, name)
+
+def connect_daemon(path):
+    # returns None if no daemon is listening on path
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+        return None
+    dev = DaemonConnection(path)
+    try:
+        dev.connect()
+    except socket.error:
+        dev.sock.close()
+        return None
+    return dev
+
+
+@cli.command(short_help='keep the connection open for other invocations')
+@click.pass_context
+def serve(ctx):
+    path = ctx.obj['socket']
+    running = connect_daemon(path)
+    if running is not None:
+        running.sock.close()
+        raise click.ClickException('a daemon is already listening on %s' % path)
+    if os.path.exists(path):
+        os.remove(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o600)
+    server.listen(16)
+    print('serving %s on %s' % (ctx.obj['address'], path))
+    try:
+        while True:
+            dev = ctx.obj['dev']
+            inputs = [server] if dev is None else [server, dev.sock]
+            readable = select.select(inputs, [], [])[0]
+            if dev is not None and dev.sock in readable:
+                drain_device(ctx)
+            if server not in readable:
+                continue
+            conn, _ = server.accept()
+            try:
+                relay(ctx, conn)
+            except socket.error:
+                pass
+            finally:
+                conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.remove(path)
+        if ctx.obj['dev'] is not None:
+            ctx.obj['dev'].disconnect()
+
+def drain_device(ctx):
+    # the timebox acknowledges every message, and not reading its input eventually
+    # crashes it (see doc/protocol.md), so discard what it sent; if it closed the
+    # connection, drop it, relay connects again when there is something to send
+    dev = ctx.obj['dev']
+    try:
+        data = dev.sock.recv(1024)
+    except (IOError, OSError):
+        data = b''
+    if not data:
+        dev.disconnect()
+        ctx.obj['dev'] = None
+
+def relay(ctx, conn):
+    # pass everything a client sends to the timebox, one client at a time so messages
+    # are not interleaved, and discard the input from the timebox meanwhile; reconnect
+    # once if the connection to the timebox was lost
+    error = None
+    while True:
+        dev = ctx.obj['dev']
+        inputs = [conn] if dev is None else [conn, dev.sock]
+        readable = select.select(inputs, [], [], 60.0)[0]
+        if not readable:
+            raise socket.timeout('client sent nothing for 60 s')
+        if dev is not None and dev.sock in readable:
+            drain_device(ctx)
+        if conn not in readable:
+            continue
+        data = conn.recv(4096)
+        if not data:
+            break
+        if error is not None:
+            continue
+        try:
+            if ctx.obj['dev'] is None:
+                ctx.obj['dev'] = connect(ctx.obj['address'])
+            ctx.obj['dev'].send_all(data)
+        except (IOError, OSError):
+            try:
+                if ctx.obj['dev'] is not None:
+                    ctx.obj['dev'].disconnect()
+                ctx.obj['dev'] = None
+                ctx.obj['dev'] = connect(ctx.obj['address'])
+                ctx.obj['dev'].send_all(data)
+            except (IOError, OSError) as err:
+                if ctx.obj['dev'] is not None:
+                    ctx.obj['dev'].disconnect()
+                    ctx.obj['dev'] = None
+                error = err
+    if error is None:
+        conn.sendall(b'OK\n')
+    else:
+        conn.sendall(('ERROR %s\n' % error).encode('utf-8'))
+
+
 if __name__ == '__main__':
     dev, disconnect = cli(obj={})
     if(disconnect):